@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+# Copyright: Tanaka Aiko (https://github.com/aiko-tanaka)
+# License: GNU AGPL, version 3 or later; https://www.gnu.org/licenses/agpl-3.0.en.html
+
+"""
+Micro-benchmark of scraper/parsers.py against the old full-tree parsing, on saved pages
+
+Pages are read either from a folder of saved .html files, e.g.
+    curl -o pages/10-jyouyoukanjiitiran.html https://okjiten.jp/10-jyouyoukanjiitiran.html
+    curl -o pages/kanji1408.html https://okjiten.jp/kanji1408.html
+    curl -o pages/tangorin-夢.html "https://tangorin.com/kanji?search=夢"
+or straight from the add-on's response cache (the kanji_cache_path folder)
+
+Usage:
+    python benchmarks/bench_parsers.py --pages pages
+    python benchmarks/bench_parsers.py --response-cache "D:\\...\\000_JAP" --repeat 20
+"""
+
+from bs4 import BeautifulSoup
+
+import importlib.util
+import argparse
+import sqlite3
+import time
+import sys
+import re
+import os
+
+# parsers.py only depends on bs4, import it directly instead of through the add-on package (which needs Anki)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'scraper'))
+import parsers
+
+
+INDEX_PAGE  = re.compile(r'(jyouyoukanjiitiran|jouyoukanjigai|jinmeiyoukanji)')
+KANJI_PAGE  = re.compile(r'kanji\d+\.html')
+TANGORIN    = re.compile(r'tangorin')
+
+
+def page_kind(name: str) -> str or None:
+    if INDEX_PAGE.search(name): return 'okjiten_index'
+    if KANJI_PAGE.search(name): return 'okjiten_kanji'
+    if TANGORIN.search(name):   return 'tangorin'
+    return None
+
+
+def load_pages_folder(folder: str) -> dict:
+    pages = {'okjiten_index': [], 'okjiten_kanji': [], 'tangorin': []}
+    for filename in sorted(os.listdir(folder)):
+        kind = page_kind(filename)
+        if kind:
+            with open(os.path.join(folder, filename), 'rb') as fh:
+                pages[kind].append(fh.read())
+    return pages
+
+
+def load_response_cache(kanji_cache_path: str,
+                        db_filename='kanji_cache.sqlite3',
+                        response_folder='responses') -> dict:
+    pages = {'okjiten_index': [], 'okjiten_kanji': [], 'tangorin': []}
+    conn = sqlite3.connect(os.path.join(kanji_cache_path, db_filename))
+    for url, digest in conn.execute('SELECT url, digest FROM responses ORDER BY url'):
+        kind = page_kind(url)
+        body_path = os.path.join(kanji_cache_path, response_folder, digest[:2], digest)
+        if kind and os.path.isfile(body_path):
+            with open(body_path, 'rb') as fh:
+                pages[kind].append(fh.read())
+    conn.close()
+    return pages
+
+
+### the old okjiten_etymology / tangorin_kanji_info parsing, kept here as the baseline
+
+def legacy_okjiten_index(html):
+    soup = BeautifulSoup(html, features='html.parser')
+    str(soup)
+    return [(a.get_text().strip(), a.get('href')) for a in soup.find_all('a', href=True)]
+
+
+def legacy_okjiten_kanji_page(html):
+    kanji_soup = BeautifulSoup(html, features='html.parser')
+    tables = kanji_soup.find_all('td', attrs={'colspan': 12})
+    if not tables: return None
+
+    for table in tables:
+        kanji_soup = table.find('td', attrs={'height': 100})
+        if kanji_soup: break
+
+    if len(tables) > 2:
+        th = tables[2].find('th', attrs={'align': 'left'})
+        if th:
+            th = BeautifulSoup(str(th), features='html.parser')
+            return ''.join(th.get_text().strip().split())
+        tr = tables[2].find_all('tr')
+        if len(tr) > 8:
+            return BeautifulSoup(str(tr[8]), features='html.parser').get_text().strip()
+    return ''
+
+
+def legacy_tangorin(html):
+    soup = BeautifulSoup(html, features='html.parser')
+    en_definitions = soup.find('p', attrs={'class': 'k-meanings'})
+    return en_definitions.get_text().strip() if en_definitions else ''
+
+
+CASES = {
+    'okjiten_index':    (legacy_okjiten_index,      parsers.parse_okjiten_index),
+    'okjiten_kanji':    (legacy_okjiten_kanji_page, parsers.parse_okjiten_kanji_page),
+    'tangorin':         (legacy_tangorin,           parsers.parse_tangorin_meanings),
+}
+
+
+def time_per_page(func, pages: list, repeat: int, **kwargs) -> float:
+    """
+    Returns:
+        best-of-repeat mean seconds per page
+    """
+    best = float('inf')
+    for i in range(repeat):
+        before = time.perf_counter()
+        for page in pages:
+            func(page, **kwargs)
+        best = min(best, time.perf_counter() - before)
+    return best / len(pages)
+
+
+def backends() -> list:
+    available = ['html.parser']
+    if importlib.util.find_spec('lxml'):
+        available.append('lxml')
+    return available
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    source = arg_parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--pages', help='folder of saved .html pages')
+    source.add_argument('--response-cache', help='kanji_cache_path of the add-on')
+    arg_parser.add_argument('--repeat', type=int, default=5)
+    args = arg_parser.parse_args()
+
+    pages = load_pages_folder(args.pages) if args.pages else load_response_cache(args.response_cache)
+
+    print('{:<16}{:>7}{:>16}{:>16}{:>10}'.format('page', 'pages', 'parser', 'ms/page', 'speed-up'))
+    for kind, (legacy, strained) in CASES.items():
+        if not pages[kind]:
+            continue
+
+        baseline = time_per_page(legacy, pages[kind], args.repeat)
+        print('{:<16}{:>7}{:>16}{:>16.3f}{:>10}'.format(kind, len(pages[kind]), 'legacy', baseline * 1000, '1.00x'))
+
+        for backend in backends():
+            elapsed = time_per_page(strained, pages[kind], args.repeat, backend=backend)
+            print('{:<16}{:>7}{:>16}{:>16.3f}{:>9.2f}x'.format(kind, len(pages[kind]), backend,
+                                                               elapsed * 1000, baseline / elapsed))
+
+
+if __name__ == '__main__':
+    main()
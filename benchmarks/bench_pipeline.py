@@ -0,0 +1,282 @@
+# -*- coding: utf-8 -*-
+# Copyright: Tanaka Aiko (https://github.com/aiko-tanaka)
+# License: GNU AGPL, version 3 or later; https://www.gnu.org/licenses/agpl-3.0.en.html
+
+"""
+Offline benchmarks of the scraping and rendering pipeline
+
+Everything runs against recorded okjiten, tangorin and dong-chinese pages served by a local stand-in
+(see standin.py), the add-on's caches are pointed at a temporary folder so nothing of the real ones is touched
+
+By default the pages are the fixed synthetic set of benchmarks/fixtures (30 kanji: the three okjiten index pages,
+their kanji pages, the tangorin searches and some dong-chinese pages), so that runs on any machine, at any time,
+measure the same input. Recordings of the add-on's own response cache can be used instead with --recordings,
+every run records the fingerprint of the pages it used
+
+Stages:
+    extract_kanji           over the vocab of every fake note
+    kanjidic2_info          cold (bank not loaded yet) and warm lookups
+    okjiten_etymology       cold (empty caches) and warm
+    dong_etymology          cold and warm
+    regen_generate          Regen.generate end-to-end over --notes fake notes, cold and warm caches
+                            (the etymology images are only queued, not downloaded, see NullImageDownloader)
+
+Every run appends one JSON line to --out, so that runs (with the same recordings fingerprint) can be compared over time
+
+Needs the packages Anki ships with (aqt, PyQt5, bs4, requests), but not Anki itself
+
+Usage:
+    python benchmarks/bench_pipeline.py run --notes 3000
+    python benchmarks/bench_pipeline.py record --response-cache "D:\\...\\000_JAP" --out benchmarks/recordings
+    python benchmarks/bench_pipeline.py run --recordings benchmarks/recordings --notes 3000
+"""
+
+import argparse
+import platform
+import tempfile
+import datetime
+import subprocess
+import random
+import time
+import json
+import sys
+import os
+
+REPO_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_PATH)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from standin import record, Recordings, StandInServer, StandInSession
+
+
+HIRAGANA = 'あいうえおかきくけこさしすせそたちつてとなにぬねのはひふへほまみむめもやゆよらりるれろわをん'
+
+
+class FakeNote(dict):
+    def __init__(self, id: int, fields: dict):
+        super().__init__(fields)
+        self.id = id
+
+    def flush(self):
+        pass
+
+
+class FakeCollection:
+    def __init__(self, notes: dict, media_folder: str):
+        self.notes = notes
+        self.media = self
+        self.media_folder = media_folder
+
+    def getNote(self, id):
+        return self.notes[id]
+
+    def dir(self):
+        return self.media_folder
+
+
+class FakeProgress:
+    def start(self, *args, **kwargs): pass
+    def update(self, *args, **kwargs): pass
+    def finish(self, *args, **kwargs): pass
+
+
+class FakeMainWindow:
+    def __init__(self, col: FakeCollection):
+        self.col = col
+        self.progress = FakeProgress()
+
+
+class NullImageDownloader:
+    """
+    Stands in for utils.image_downloader, the etymology images aren't part of the recordings
+    and downloading them would only measure the retries and sleeps of the failing requests
+    """
+    def __init__(self):
+        self.submitted = set()
+
+    def submit(self, online_url, filename, *args, **kwargs):
+        self.submitted.add(online_url)
+
+    def wait(self):
+        pass
+
+
+def fake_notes(kanji_pool: list, count: int, vocab_field: str, seed=0) -> dict:
+    """
+    {note id: FakeNote} with 1-4 kanji (and some kana) per vocab, common kanji repeat like in a real deck
+    """
+    rng = random.Random(seed)
+    notes = dict()
+    for note_id in range(1, count + 1):
+        vocab = ''.join(rng.choice(kanji_pool) + rng.choice(HIRAGANA) * rng.randint(0, 1)
+                        for i in range(rng.randint(1, 4)))
+        notes[note_id] = FakeNote(note_id, {vocab_field: vocab})
+    return notes
+
+
+class Bench:
+    def __init__(self, server: StandInServer):
+        self.server = server
+        self.results = dict()
+
+    def measure(self, name: str, func, items: int):
+        self.server.reset()
+        before = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - before
+
+        self.results[name] = {
+            'seconds':      round(elapsed, 6),
+            'items':        items,
+            'per_item_ms':  round(elapsed / max(items, 1) * 1000, 6),
+            'requests':     self.server.reset(),
+        }
+        print('{:<28}{:>10.3f}s{:>8} items{:>12.3f} ms/item   requests: {}'.format(
+            name, elapsed, items, elapsed / max(items, 1) * 1000, self.results[name]['requests']))
+
+
+def git_commit() -> str or None:
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=REPO_PATH).decode().strip()
+    except Exception:
+        return None
+
+
+def run(args):
+    recordings = Recordings(args.recordings)
+    server = StandInServer(recordings)
+    server.start()
+
+    # the add-on reads its default config.json when mw is None
+    from scraper import webfinder, utils, online_dictionaries, offline_dictionaries, parsers, kanji_mecab
+    from scraper.kanji_cache import close_caches, commit_caches
+    from scraper.http_client import http_client
+    from scraper.config import config
+
+    work_folder = tempfile.mkdtemp(prefix='kanji_etym_bench_')
+    media_folder = os.path.join(work_folder, 'collection.media')
+    os.makedirs(media_folder)
+
+    def fresh_caches():
+        close_caches()
+        cache_folder = tempfile.mkdtemp(dir=work_folder)
+        config['kanji_cache_path'] = cache_folder
+
+    config['offline_only'] = False
+    http_client._session = StandInSession(server.base)
+    webfinder.image_downloader = NullImageDownloader()
+    offline_dictionaries.anki_connect.host = '127.0.0.1'
+    offline_dictionaries.anki_connect.port = server.port
+
+    if args.mecab_path:
+        sys.path.append(args.mecab_path)
+    else:
+        # MeCab isn't part of the benchmark unless its controller is available
+        kanji_mecab.generate_furigana = lambda text, skip_words=None: text or ''
+    webfinder.showInfo = lambda *args, **kwargs: None
+    # the warm Regen.generate run has to render the notes the cold one already filled
+    webfinder.force_update = True
+
+    bench = Bench(server)
+    fresh_caches()
+
+    ### the kanji that can actually be resolved from the recordings
+    index = online_dictionaries.okjiten_index(refresh=True)
+    recorded = {Recordings.normalize(url) for url in recordings.urls()}
+    okjiten_kanji = [kanji for kanji, (site, href) in index.items()
+                     if Recordings.normalize('https://okjiten.jp/' + href) in recorded]
+    dong_kanji = [Recordings.normalize(url).rsplit('/', 1)[-1] for url in recordings.urls()
+                  if 'dong-chinese.com/dictionary/' in url]
+    kanji_pool = okjiten_kanji + [kanji for kanji in dong_kanji if kanji not in okjiten_kanji]
+    if not kanji_pool:
+        sys.exit('the recordings do not contain any okjiten kanji page')
+
+    notes = fake_notes(kanji_pool, args.notes, webfinder.vocab_field)
+    vocab_list = [note[webfinder.vocab_field] for note in notes.values()]
+
+    ### extract_kanji
+    bench.measure('extract_kanji',
+                  lambda: [utils.extract_kanji(vocab) for vocab in vocab_list],
+                  len(vocab_list))
+
+    ### kanjidic2_info
+    bank_kanji = list(offline_dictionaries.load_kanjidic2().keys())
+    offline_dictionaries._kanjidic2['path'] = None
+    bench.measure('kanjidic2_info_cold', lambda: offline_dictionaries.kanjidic2_info(bank_kanji[0]), 1)
+    bench.measure('kanjidic2_info_warm',
+                  lambda: [offline_dictionaries.kanjidic2_info(kanji) for kanji in bank_kanji],
+                  len(bank_kanji))
+
+    ### okjiten_etymology
+    fresh_caches()
+    def okjiten_cold():
+        online_dictionaries.okjiten_index(refresh=True)
+        online_dictionaries.okjiten_etymology(okjiten_kanji)
+        commit_caches()
+    bench.measure('okjiten_etymology_cold', okjiten_cold, len(okjiten_kanji))
+    bench.measure('okjiten_etymology_warm',
+                  lambda: online_dictionaries.okjiten_etymology(okjiten_kanji),
+                  len(okjiten_kanji))
+
+    ### dong_etymology
+    if dong_kanji:
+        fresh_caches()
+        def dong_cold():
+            online_dictionaries.dong_etymology(dong_kanji)
+            commit_caches()
+        bench.measure('dong_etymology_cold', dong_cold, len(dong_kanji))
+        bench.measure('dong_etymology_warm', lambda: online_dictionaries.dong_etymology(dong_kanji), len(dong_kanji))
+
+    ### Regen.generate end-to-end
+    def regen():
+        webfinder.mw = sys.modules['aqt'].mw = FakeMainWindow(FakeCollection(notes, media_folder))
+        webfinder.Regen(fids=list(notes.keys())).generate()
+
+    fresh_caches()
+    online_dictionaries.okjiten_index(refresh=True)
+    bench.measure('regen_generate_cold', regen, len(notes))
+    bench.measure('regen_generate_warm', regen, len(notes))
+
+    server.stop()
+    close_caches()
+
+    run_record = {
+        'timestamp':        datetime.datetime.now().isoformat(timespec='seconds'),
+        'commit':           git_commit(),
+        'python':           platform.python_version(),
+        'parser_backend':   parsers.PARSER_BACKEND,
+        'notes':            len(notes),
+        'unique_kanji':     len(kanji_pool),
+        'recorded_pages':   len(recordings.urls()),
+        'recordings':       recordings.fingerprint(),
+        'results':          bench.results,
+    }
+    with open(args.out, 'a', encoding='utf8') as fh:
+        fh.write(json.dumps(run_record, ensure_ascii=False) + '\n')
+    print('results appended to {}'.format(args.out))
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = arg_parser.add_subparsers(dest='command', required=True)
+
+    record_parser = commands.add_parser('record', help='copy the add-on\'s response cache into a recordings folder')
+    record_parser.add_argument('--response-cache', required=True, help='kanji_cache_path of the add-on')
+    record_parser.add_argument('--out', default=os.path.join(REPO_PATH, 'benchmarks', 'recordings'))
+
+    run_parser = commands.add_parser('run', help='run the benchmarks against a recordings folder')
+    run_parser.add_argument('--recordings', default=os.path.join(REPO_PATH, 'benchmarks', 'fixtures'),
+                            help='recordings folder, the committed synthetic pages by default')
+    run_parser.add_argument('--notes', type=int, default=3000)
+    run_parser.add_argument('--mecab-path', help='folder containing mecab_controller, to include furigana')
+    run_parser.add_argument('--out', default=os.path.join(REPO_PATH, 'benchmarks', 'results.jsonl'))
+
+    args = arg_parser.parse_args()
+    if args.command == 'record':
+        print('recorded {} responses into {}'.format(record(args.response_cache, args.out), args.out))
+    else:
+        run(args)
+
+
+if __name__ == '__main__':
+    main()
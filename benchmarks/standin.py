@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+# Copyright: Tanaka Aiko (https://github.com/aiko-tanaka)
+# License: GNU AGPL, version 3 or later; https://www.gnu.org/licenses/agpl-3.0.en.html
+
+"""
+Local HTTP stand-in for okjiten, tangorin, dong-chinese and AnkiConnect, used by the benchmarks
+
+Recordings are a folder with an index.json ({url: body filename}) and the recorded bodies,
+benchmarks/fixtures is a small synthetic one, others can be made from the add-on's response cache with:
+    python benchmarks/bench_pipeline.py record --response-cache "D:\\...\\000_JAP" --out benchmarks/recordings
+
+The scraper's requests sessions are swapped for StandInSession, which sends
+https://okjiten.jp/kanji1408.html to http://127.0.0.1:<port>/okjiten.jp/kanji1408.html
+"""
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from collections import Counter
+
+import urllib.parse
+import threading
+import requests
+import hashlib
+import sqlite3
+import shutil
+import json
+import os
+
+
+def record(kanji_cache_path: str,
+           out_folder: str,
+           db_filename='kanji_cache.sqlite3',
+           response_folder='responses') -> int:
+    """
+    Copies every response of the add-on's response cache into a recordings folder
+    Returns:
+        number of recorded responses
+    """
+    os.makedirs(out_folder, exist_ok=True)
+
+    index = dict()
+    conn = sqlite3.connect(os.path.join(kanji_cache_path, db_filename))
+    for url, digest in conn.execute('SELECT url, digest FROM responses'):
+        body_path = os.path.join(kanji_cache_path, response_folder, digest[:2], digest)
+        if os.path.isfile(body_path):
+            shutil.copyfile(body_path, os.path.join(out_folder, digest))
+            index[url] = digest
+    conn.close()
+
+    with open(os.path.join(out_folder, 'index.json'), 'w', encoding='utf8') as fh:
+        json.dump(index, fh, ensure_ascii=False, indent=4)
+
+    return len(index)
+
+
+class Recordings:
+    def __init__(self, folder: str):
+        self.folder = folder
+        with open(os.path.join(folder, 'index.json'), 'r', encoding='utf8') as fh:
+            self.index: dict = json.load(fh)
+        self._bodies = dict()
+
+    @staticmethod
+    def normalize(url: str) -> str:
+        # the same url can be quoted differently by the scraper and by requests
+        return urllib.parse.unquote(url)
+
+    def urls(self) -> list:
+        return list(self.index.keys())
+
+    def fingerprint(self) -> str:
+        """
+        sha1 of every recorded url and body, two runs only measured the same input if it's the same
+        """
+        digest = hashlib.sha1()
+        for url in sorted(self.index):
+            digest.update(self.normalize(url).encode('utf8'))
+            digest.update(self.body(url) or b'')
+        return digest.hexdigest()
+
+    def body(self, url: str) -> bytes or None:
+        if not self._bodies:
+            for recorded_url, filename in self.index.items():
+                with open(os.path.join(self.folder, filename), 'rb') as fh:
+                    self._bodies[self.normalize(recorded_url)] = fh.read()
+        return self._bodies.get(self.normalize(url))
+
+
+class StandInServer:
+    """
+    Attributes
+    ----------
+    requests : Counter
+        host -> number of requests served, reset() it between benchmark stages
+    """
+    def __init__(self, recordings: Recordings):
+        self.recordings = recordings
+        self.requests   = Counter()
+
+        stand_in = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                # /okjiten.jp/kanji1408.html -> https://okjiten.jp/kanji1408.html
+                host = self.path.lstrip('/').split('/', 1)[0].split('?', 1)[0]
+                stand_in.requests[host] += 1
+
+                body = stand_in.recordings.body('https:/' + self.path)
+                self._reply(200 if body is not None else 404, body or b'')
+
+            def do_POST(self):
+                # AnkiConnect, every query comes back empty
+                stand_in.requests['ankiconnect'] += 1
+                payload = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+
+                if payload.get('action') == 'multi':
+                    result = [{'result': [], 'error': None} for action in payload['params']['actions']]
+                else:
+                    result = []
+                self._reply(200, json.dumps({'result': result, 'error': None}).encode('utf8'))
+
+            def _reply(self, status: int, body: bytes):
+                self.send_response(status)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self._server.daemon_threads = True
+        self.port = self._server.server_address[1]
+        self.base = 'http://127.0.0.1:{}'.format(self.port)
+
+    def start(self):
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+
+    def stop(self):
+        self._server.shutdown()
+
+    def reset(self) -> dict:
+        counts = dict(self.requests)
+        self.requests.clear()
+        return counts
+
+
+class StandInSession(requests.Session):
+    """
+    requests session that sends every https request to the stand-in server instead
+    """
+    def __init__(self, base: str):
+        super().__init__()
+        self.base = base
+
+    def request(self, method, url, *args, **kwargs):
+        parts = urllib.parse.urlsplit(url)
+        if parts.scheme == 'https':
+            url = '{}/{}{}'.format(self.base, parts.netloc, parts.path)
+            if parts.query: url += '?' + parts.query
+        return super().request(method, url, *args, **kwargs)
@@ -2,4 +2,8 @@
 # Copyright: Tanaka Aiko (https://github.com/aiko-tanaka)
 # License: GNU AGPL, version 3 or later; https://www.gnu.org/licenses/agpl-3.0.en.html
 
-from . import webfinder
\ No newline at end of file
+from .config import main_window
+
+# the menus are only added inside Anki, the scraping modules can also be used on their own (see prewarm.py)
+if main_window() is not None:
+    from . import webfinder
\ No newline at end of file
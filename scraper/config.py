@@ -5,13 +5,30 @@
 # parts of this code are copied from tatsumoto-ren/Ajatt-tools
 # https://github.com/Ajatt-Tools/PasteImagesAsWebP/blob/main/config.py
 
-from aqt import mw
-
 from .consts import ADDON_PATH
 
+import json
+import sys
+import os
+
+
+def main_window():
+    """
+    Anki's main window, None outside of Anki (e.g. prewarm.py and the benchmarks)
+    aqt is never imported from here, so the scraping modules can be loaded without the Anki GUI
+    """
+    aqt = sys.modules.get('aqt')
+    return getattr(aqt, 'mw', None)
+
 
 def get_config() -> dict:
-    cfg: dict = mw.addonManager.getConfig(__name__) or dict()
+    mw = main_window()
+    if mw is not None:
+        cfg: dict = mw.addonManager.getConfig(__name__) or dict()
+    else:
+        # outside of Anki (e.g. prewarm.py or the benchmarks), mw is None, use the default config.json of the add-on
+        with open(os.path.join(ADDON_PATH, 'config.json'), 'r', encoding='utf8') as fh:
+            cfg: dict = json.load(fh)
 
     # https://stackoverflow.com/questions/11152559/best-idiom-to-get-and-set-a-value-in-a-python-dict
     cfg['kanji_etym_field']: str        = cfg.get('kanji_etym_field', 'Okjiten_Kanji_Etym')
@@ -29,10 +46,57 @@ def get_config() -> dict:
     cfg['kanji_cache_path']: str        = cfg.get('kanji_cache_path',
                                                   r'D:\Libraries\Documents\MEGA\MEGAsync\000_JAP')
     cfg['okjiten_cache_filename']: str  = cfg.get('okjiten_cache_filename', 'okjiten_cache.json')
+    cfg['kanji_cache_db_filename']: str = cfg.get('kanji_cache_db_filename', 'kanji_cache.sqlite3')
+    cfg['okjiten_index_filename']: str  = cfg.get('okjiten_index_filename', 'okjiten_index.json')
+    cfg['okjiten_index_max_age_days']: int = cfg.get('okjiten_index_max_age_days', 30)
+
+    cfg['scraper_workers']: int         = cfg.get('scraper_workers', 4)
+    cfg['max_connections_per_host']: int = cfg.get('max_connections_per_host', 2)
+    cfg['http_timeout']: float          = cfg.get('http_timeout', 5.0)
+    cfg['http_retries']: int            = cfg.get('http_retries', 3)
+    cfg['http_backoff']: float          = cfg.get('http_backoff', 0.25)
+    cfg['host_requests_per_second']: float = cfg.get('host_requests_per_second', 4.0)
+    cfg['host_burst']: int              = cfg.get('host_burst', 4)
+    cfg['circuit_breaker_failures']: int = cfg.get('circuit_breaker_failures', 5)
+    cfg['circuit_breaker_cooldown']: float = cfg.get('circuit_breaker_cooldown', 120)
+
+    cfg['response_cache_folder']: str   = cfg.get('response_cache_folder', 'responses')
+    cfg['response_cache_max_mb']: float = cfg.get('response_cache_max_mb', 200)
+    cfg['response_cache_ttl_days']: dict = cfg.get('response_cache_ttl_days', {
+                                                       'okjiten.jp':           30,
+                                                       'tangorin.com':         30,
+                                                       'dong-chinese.com':     30,
+                                                       'default':              7,
+                                                   })
+    cfg['offline_only']: bool           = cfg.get('offline_only', False)
+    cfg['okjiten_fresh_days']: float    = cfg.get('okjiten_fresh_days', 90)
+
+    cfg['tangorin_cache_days']: float   = cfg.get('tangorin_cache_days', 180)
+    cfg['tangorin_negative_cache_days']: float = cfg.get('tangorin_negative_cache_days', 14)
+
+    cfg['ankiconnect_batch_size']: int  = cfg.get('ankiconnect_batch_size', 400)
+    cfg['mecab_batch_max_bytes']: int   = cfg.get('mecab_batch_max_bytes', 4096)
+
+    cfg['definition_hedge_delay']: float = cfg.get('definition_hedge_delay', 0.3)
+    cfg['definition_deadline']: float   = cfg.get('definition_deadline', 8.0)
+
+    cfg['image_download_workers']: int  = cfg.get('image_download_workers', 4)
+    cfg['image_download_retries']: int  = cfg.get('image_download_retries', 3)
+    cfg['image_download_timeout']: float = cfg.get('image_download_timeout', 10.0)
+
+    cfg['metrics_enabled']: bool        = cfg.get('metrics_enabled', True)
+    cfg['profiling_mode']: str          = cfg.get('profiling_mode', 'sampled')
+    cfg['profiling_sample_every']: int  = max(1, cfg.get('profiling_sample_every', 50))
+
+    cfg['regen_in_background']: bool    = cfg.get('regen_in_background', True)
+    cfg['regen_chunk_size']: int        = max(1, cfg.get('regen_chunk_size', 100))
+    cfg['regen_journal_folder']: str    = cfg.get('regen_journal_folder', 'regen_journal')
+    cfg['progress_interval_ms']: float  = cfg.get('progress_interval_ms', 100)
 
     cfg['kanjidic_folder']: str         = ADDON_PATH or cfg.get('kanjidic_folder')
     cfg['kanjidic_filename']: str       = cfg.get('kanjidic_filename',
                                                   'kanji_bank_complete-dict-format.json')
+    cfg['kanjidic_check_mtime']: bool   = cfg.get('kanjidic_check_mtime', True)
 
 
     return cfg
@@ -41,5 +105,4 @@ def get_config() -> dict:
 config = get_config()
 
 if __name__ == '__main__':
-    import os
     print(os.path.dirname(__file__))
\ No newline at end of file
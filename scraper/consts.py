@@ -14,6 +14,11 @@ ADDON_NAME = "Kanji Etymology"
 LABEL_PROGRESS_UPDATE = 'Scraping Kanji Etymologies'
 # text shown on menu to run the functions
 LABEL_MENU = 'Extract Kanji from Vocab, and fetch etymologies into Kanji_Etym field'
+# re-render the notes of some kanji only
+LABEL_MENU_RERENDER = 'Re-render Kanji_Etym field of the notes containing kanji...'
+LABEL_RERENDER_PROMPT = 'Kanji to re-render (e.g. 夢紋):'
+# name of the undo entry of a whole run
+LABEL_UNDO = 'Fetch Kanji Etymologies'
 
 if __name__ == '__main__':
     print(ADDON_PATH)
\ No newline at end of file
@@ -0,0 +1,285 @@
+# -*- coding: utf-8 -*-
+# Copyright: Tanaka Aiko (https://github.com/aiko-tanaka)
+# License: GNU AGPL, version 3 or later; https://www.gnu.org/licenses/agpl-3.0.en.html
+
+"""
+Shared HTTP client used by try_access_site (okjiten, tangorin and dong-chinese)
+
+- one requests session, so connections (and TLS handshakes) are pooled and kept alive per host
+- at most max_connections_per_host requests to the same host at any time
+- retries with exponential backoff + jitter instead of a fixed ~80ms sleep
+- responses are kept in the on-disk response_cache, fresh ones are served without touching the network
+- stale ones are revalidated with ETag/Last-Modified, an unchanged page returns a 304 and the saved body is reused
+- with offline_only set, nothing but the response_cache is used
+- requests to each host go through a token bucket (host_requests_per_second, host_burst)
+- after circuit_breaker_failures unreachable fetches in a row a host is skipped for circuit_breaker_cooldown seconds,
+  then a single trial request decides whether it's back
+"""
+
+from .response_cache import response_cache
+from .metrics import metrics
+from .config import config
+
+import requests
+import requests.adapters
+
+import urllib.parse
+import threading
+import random
+import time
+
+
+# statuses worth retrying, anything else (e.g. 404) is returned right away as a failure
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class TokenBucket:
+    """
+    rate tokens per second, at most burst of them saved up
+    """
+    def __init__(self, rate: float, burst: int):
+        self.rate       = rate
+        self.burst      = max(1, burst)
+        self._tokens    = float(self.burst)
+        self._updated   = time.monotonic()
+        self._lock      = threading.Lock()
+
+    def acquire(self):
+        if not self.rate:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait_time = (1 - self._tokens) / self.rate
+            time.sleep(wait_time)
+
+
+class CircuitBreaker:
+    """
+    Attributes
+    ----------
+    failures : int
+        unreachable fetches in a row
+    opened_at : float or None
+        monotonic time the circuit was opened, None while the host is healthy
+    skipped : int
+        requests short-circuited since the last reset_skipped()
+    """
+    def __init__(self):
+        self.failures   = 0
+        self.opened_at  = None
+        self.skipped    = 0
+        self._trial     = False
+        self._lock      = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            # half-open: once the cool-down is over, a single request is let through to test the host
+            if not self._trial and time.monotonic() - self.opened_at >= config.get('circuit_breaker_cooldown'):
+                self._trial = True
+                return True
+            self.skipped += 1
+            return False
+
+    @property
+    def is_open(self) -> bool:
+        """
+        True once the circuit opened, except for the half-open trial request
+        """
+        with self._lock:
+            return self.opened_at is not None and not self._trial
+
+    def success(self):
+        with self._lock:
+            self.failures   = 0
+            self.opened_at  = None
+            self._trial     = False
+
+    def failure(self):
+        with self._lock:
+            self.failures += 1
+            if self._trial or self.failures >= config.get('circuit_breaker_failures'):
+                self.opened_at  = time.monotonic()
+                self._trial     = False
+
+
+class HttpClient:
+    def __init__(self):
+        self._session           = None
+        self._host_semaphores   = dict()
+        self._host_buckets      = dict()
+        self._host_breakers     = dict()
+        self._lock              = threading.Lock()
+
+
+    @property
+    def session(self) -> requests.Session:
+        with self._lock:
+            if self._session is None:
+                pool_size = config.get('max_connections_per_host')
+                adapter = requests.adapters.HTTPAdapter(pool_maxsize=pool_size)
+                self._session = requests.Session()
+                self._session.mount('https://', adapter)
+                self._session.mount('http://', adapter)
+            return self._session
+
+
+    def host_semaphore(self, url: str) -> threading.BoundedSemaphore:
+        """
+        one semaphore per host, caps how many requests (from any scraping thread) hit the same site at once
+        """
+        host = urllib.parse.urlsplit(url).netloc
+
+        with self._lock:
+            semaphore = self._host_semaphores.get(host)
+            if semaphore is None:
+                semaphore = threading.BoundedSemaphore(config.get('max_connections_per_host'))
+                self._host_semaphores[host] = semaphore
+
+        return semaphore
+
+
+    def host_bucket(self, url: str) -> TokenBucket:
+        host = urllib.parse.urlsplit(url).netloc
+
+        with self._lock:
+            bucket = self._host_buckets.get(host)
+            if bucket is None:
+                bucket = TokenBucket(config.get('host_requests_per_second'), config.get('host_burst'))
+                self._host_buckets[host] = bucket
+
+        return bucket
+
+
+    def host_breaker(self, url: str) -> CircuitBreaker:
+        host = urllib.parse.urlsplit(url).netloc
+
+        with self._lock:
+            breaker = self._host_breakers.get(host)
+            if breaker is None:
+                breaker = self._host_breakers[host] = CircuitBreaker()
+
+        return breaker
+
+
+    def skipped_hosts(self, reset=True) -> dict:
+        """
+        Returns:
+            host -> number of requests skipped because its circuit was open, e.g. for the end of run summary
+        """
+        with self._lock:
+            breakers = list(self._host_breakers.items())
+
+        skipped = dict()
+        for host, breaker in breakers:
+            with breaker._lock:
+                if breaker.skipped:
+                    skipped[host] = breaker.skipped
+                if reset:
+                    breaker.skipped = 0
+        return skipped
+
+
+    @staticmethod
+    def _stale_body(saved: dict or None, revalidate: bool) -> bytes or None:
+        """
+        The site couldn't be reached (or its circuit is open), a stale page is still better than nothing,
+        unless the caller asked for a revalidation
+        """
+        if revalidate or not saved:
+            return None
+        return saved['body']
+
+
+    def get(self,
+            url: str,
+            num_retries: int = None,
+            wait_time: float = 15.0,
+            timeout: float = None,
+            backoff: float = None,
+            revalidate: bool = False) -> bytes or None:
+        """
+        Args:
+            num_retries:    retries after the first attempt, defaults to the http_retries config
+            wait_time:      no new attempt is started once this many seconds have passed
+            timeout:        per-request timeout (seconds), defaults to the http_timeout config
+            backoff:        base delay (seconds) of the exponential backoff, defaults to the http_backoff config
+            revalidate:     don't serve a fresh saved response, ask the site (conditionally, so usually a 304)
+        Returns:
+            the body of the response (or of the saved stale response if the site couldn't be reached)
+            None if the site couldn't be reached and nothing was saved
+            with revalidate, None as well if the site couldn't be reached, the saved body isn't a revalidated one
+        """
+        num_retries = config.get('http_retries') if num_retries is None else num_retries
+        timeout     = timeout or config.get('http_timeout')
+        backoff     = backoff or config.get('http_backoff')
+
+        initial_time = time.time()
+
+        saved = response_cache.lookup(url)
+        if saved and ((saved['fresh'] and not revalidate) or config.get('offline_only')):
+            metrics.count('response_cache_hit')
+            return saved['body']
+        metrics.count('response_cache_miss')
+        if config.get('offline_only'):
+            return None
+
+        breaker = self.host_breaker(url)
+        if not breaker.allow():
+            metrics.count('circuit_open_skip')
+            return self._stale_body(saved, revalidate)
+
+        headers = dict()
+        if saved:
+            if saved.get('etag'):           headers['If-None-Match']        = saved['etag']
+            if saved.get('last_modified'):  headers['If-Modified-Since']    = saved['last_modified']
+
+        with self.host_semaphore(url):
+            for attempt in range(num_retries + 1):
+                if attempt:
+                    # full jitter: sleep anywhere between 0 and backoff * 2^attempt
+                    time.sleep(random.uniform(0, backoff * 2 ** attempt))
+                    if time.time() - initial_time > wait_time: break
+
+                # the circuit may have opened while this request was waiting for the semaphore
+                if breaker.is_open:
+                    metrics.count('circuit_open_skip')
+                    return self._stale_body(saved, revalidate)
+
+                self.host_bucket(url).acquire()
+                try:
+                    response = self.session.get(url, headers=headers, timeout=timeout)
+                except requests.RequestException:
+                    continue
+
+                if response.status_code in RETRY_STATUSES:
+                    continue
+
+                # the host answered, even a 404 means it's up
+                breaker.success()
+
+                if response.status_code == 304 and saved:
+                    response_cache.revalidated(url)
+                    return saved['body']
+
+                if response.status_code != 200:
+                    return None
+
+                response_cache.store(url,
+                                     response.content,
+                                     etag=response.headers.get('ETag'),
+                                     last_modified=response.headers.get('Last-Modified'))
+                return response.content
+
+        breaker.failure()
+        return self._stale_body(saved, revalidate)
+
+
+http_client = HttpClient()
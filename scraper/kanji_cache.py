@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+# Copyright: Tanaka Aiko (https://github.com/aiko-tanaka)
+# License: GNU AGPL, version 3 or later; https://www.gnu.org/licenses/agpl-3.0.en.html
+
+"""
+SQLite backed keyed caches
+
+Every cache is a table of key -> JSON value inside a single sqlite file in kanji_cache_path
+The file is only opened on first use, reads are keyed lookups, and writes are kept in memory
+until commit_caches() is called, which happens once at the end of every Regen.generate run
+"""
+
+from .config import config
+
+import threading
+import sqlite3
+import json
+import time
+import os
+
+
+# every cache ever created, so that commit_caches() can flush all of them at once
+_caches = []
+
+
+def register_cache(cache):
+    """
+    Anything with commit() and close() methods can be flushed by commit_caches() and close_caches()
+    """
+    _caches.append(cache)
+
+
+def open_cache_db() -> sqlite3.Connection:
+    db_path = os.path.join(config.get('kanji_cache_path'), config.get('kanji_cache_db_filename'))
+
+    # the connection is shared by the scraping threads, its users serialize access with their own lock
+    return sqlite3.connect(db_path, check_same_thread=False)
+
+
+class KeyedCache:
+    """
+    Attributes
+    ----------
+    table : str
+        name of the sqlite table holding this cache
+    legacy_json_key : str
+        optional config key of the filename of a legacy {key: value} JSON file inside kanji_cache_path,
+        imported once if the table is still empty. Both are read when the cache is first opened,
+        so a kanji_cache_path changed after import (e.g. prewarm --kanji-cache-path) is the one looked at
+    """
+    def __init__(self, table: str, legacy_json_key: str = None):
+        self.table              = table
+        self.legacy_json_key    = legacy_json_key
+        self._conn          = None
+        # key -> (value, updated_at), not yet written to the sqlite file
+        self._pending       = dict()
+        self._lock          = threading.RLock()
+        register_cache(self)
+
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._conn = open_cache_db()
+            self._conn.execute(f'CREATE TABLE IF NOT EXISTS {self.table} ('
+                               f'key TEXT PRIMARY KEY, '
+                               f'value TEXT NOT NULL, '
+                               f'updated_at REAL NOT NULL)')
+            self._conn.commit()
+
+            if self.legacy_json_key:
+                migrate_json_cache(self, os.path.join(config.get('kanji_cache_path'),
+                                                      config.get(self.legacy_json_key)))
+
+        return self._conn
+
+
+    def get_entry(self, key: str) -> (object, float) or None:
+        """
+        Returns:
+            (value, updated_at) or None if the key isn't cached
+        """
+        with self._lock:
+            if key in self._pending:
+                return self._pending[key]
+
+            row = self._connect().execute(f'SELECT value, updated_at FROM {self.table} WHERE key = ?',
+                                          (key,)).fetchone()
+        if row is None:
+            return None
+
+        return json.loads(row[0]), row[1]
+
+
+    def get(self, key: str, default=None):
+        entry = self.get_entry(key)
+        return entry[0] if entry else default
+
+
+    def put(self, key: str, value, updated_at: float = None):
+        """
+        Queue a value to be saved, it is only written to disk on commit()
+        """
+        with self._lock:
+            self._pending[key] = (value, updated_at or time.time())
+
+
+    def put_many(self, items: dict, updated_at: float = None):
+        updated_at = updated_at or time.time()
+        with self._lock:
+            for key, value in items.items():
+                self._pending[key] = (value, updated_at)
+
+
+    def is_empty(self) -> bool:
+        with self._lock:
+            if self._pending:
+                return False
+            row = self._connect().execute(f'SELECT 1 FROM {self.table} LIMIT 1').fetchone()
+        return row is None
+
+
+    def commit(self, keys: list = None):
+        """
+        Writes every pending value (or only the pending values of keys) inside a single transaction
+        """
+        with self._lock:
+            keys = [key for key in (self._pending if keys is None else keys) if key in self._pending]
+            if not keys:
+                return
+
+            rows = [(key, json.dumps(self._pending[key][0], ensure_ascii=False), self._pending[key][1])
+                    for key in keys]
+
+            conn = self._connect()
+            with conn:
+                conn.executemany(f'INSERT OR REPLACE INTO {self.table} (key, value, updated_at) '
+                                 f'VALUES (?, ?, ?)', rows)
+            for key in keys:
+                del self._pending[key]
+
+
+    def close(self):
+        """
+        Commits then closes the sqlite file, it is opened again (with the current config) on next use
+        """
+        with self._lock:
+            self.commit()
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+def commit_caches():
+    """
+    Flushes the pending writes of every cache, call once at the end of a batch
+    """
+    for cache in _caches:
+        cache.commit()
+
+
+def close_caches():
+    """
+    Closes every cache, e.g. after kanji_cache_path was changed
+    """
+    for cache in _caches:
+        cache.close()
+
+
+def migrate_json_cache(cache: KeyedCache, json_path: str):
+    """
+    One-time import of the old whole-file JSON cache ({kanji: kanji_info}) into a KeyedCache
+
+    The JSON file is renamed to *.migrated afterwards so that it's never imported twice
+    """
+    if not os.path.isfile(json_path):
+        return
+
+    with cache._lock:
+        if not cache.is_empty():
+            return
+
+        try:
+            with open(json_path, 'r', encoding='utf8') as fh:
+                data: dict = json.load(fh)
+        except json.decoder.JSONDecodeError:
+            return
+
+        # the old cache had no timestamps, treat everything as fetched when the JSON file was last written
+        cache.put_many(data, updated_at=os.path.getmtime(json_path))
+        cache.commit()
+
+    os.replace(json_path, json_path + '.migrated')
@@ -2,6 +2,19 @@
 # Copyright: Tanaka Aiko (https://github.com/aiko-tanaka)
 # License: GNU AGPL, version 3 or later; https://www.gnu.org/licenses/agpl-3.0.en.html
 
+"""
+Furigana through the MeCab of the AJT Japanese add-on
+
+The readings of the etymology texts are saved in the 'furigana' table of the kanji cache,
+keyed by a hash of the source text, so each text is only sent to MeCab once
+(and again only if okjiten changes it)
+"""
+
+from .kanji_cache import KeyedCache
+from .metrics import metrics
+from .config import config
+
+import hashlib
 import sys
 
 import os
@@ -17,17 +30,130 @@ if __name__ == '__main__':
     sys.path.append('../1344485230/mecab_controller')
 else:
     sys.path.append('./mecab_controller')
-ajt_furigana = __import__('mecab_controller')
 
-mecab = ajt_furigana.MecabController()
+# MeCab is only started the first time furigana is actually needed
+_mecab = None
+
+# sha1 of the source text -> furigana
+furigana_store = KeyedCache('furigana')
+
+# joins the texts of a batch into a single MeCab query, MeCab leaves the symbol as is
+BATCH_SEPARATOR = '␞'
+
+
+def get_mecab():
+    global _mecab
+    if _mecab is None:
+        ajt_furigana = __import__('mecab_controller')
+        _mecab = ajt_furigana.MecabController()
+    return _mecab
+
+
+def reset_mecab():
+    """
+    Drops the MeCab controller, a new one (with its own MeCab process) is started the next time it's needed
+    """
+    global _mecab
+    _mecab = None
+
 
 def generate_furigana(text: str, skip_words=None) -> str:
-    res = mecab.reading(text, skip_words)
+    res = get_mecab().reading(text, skip_words)
     if res:
         return res
     else:
         return ''
 
+
+def text_digest(text: str) -> str:
+    return hashlib.sha1(text.encode('utf8')).hexdigest()
+
+
+def _batches(texts: list, max_bytes: int) -> list:
+    """
+    Splits the texts into batches whose joined query stays under max_bytes (UTF-8),
+    MeCab cuts longer input lines into several output lines
+    """
+    separator_size = len(BATCH_SEPARATOR.encode('utf8'))
+    batches, batch, size = [], [], 0
+    for text in texts:
+        text_size = len(text.encode('utf8')) + separator_size
+        if batch and size + text_size > max_bytes:
+            batches.append(batch)
+            batch, size = [], 0
+        batch.append(text)
+        size += text_size
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def _generate_furigana_batch(texts: list) -> list or None:
+    """
+    Sends every text to MeCab in one round trip, texts can't contain newlines (MeCab reads line by line)
+    Returns:
+        the reading of each text, None if the joined reading can't be split back into as many parts
+        (MeCab's output is then out of step with the queries, its next lines would be read as the readings
+        of the next queries, so MeCab is restarted instead of queried again)
+    """
+    if len(texts) == 1:
+        return [generate_furigana(texts[0])]
+
+    readings = generate_furigana(BATCH_SEPARATOR.join(texts)).split(BATCH_SEPARATOR)
+    if len(readings) == len(texts):
+        return readings
+
+    metrics.count('furigana_batch_failed')
+    reset_mecab()
+    return None
+
+
+def cached_furigana(texts: list) -> dict:
+    """
+    Args:
+        texts:      etymology texts, duplicates and empty texts are fine
+    Returns:
+        {text: furigana}, only the texts that aren't cached yet go through MeCab
+        the texts of a failed batch get '' and aren't cached, they go through MeCab again next time
+    """
+    furigana = dict()
+    missing = []
+    for text in dict.fromkeys(texts):
+        if not text:
+            furigana[text] = ''
+            continue
+
+        cached = furigana_store.get(text_digest(text))
+        if cached is not None:
+            furigana[text] = cached
+            metrics.count('furigana_cache_hit')
+        else:
+            missing.append(text)
+
+    metrics.count('furigana_cache_miss', len(missing))
+
+    if missing:
+        # newlines split the MeCab output into several lines, those texts are queried on their own
+        batchable = [text for text in missing if '\n' not in text]
+        readings = dict()
+        failed = set()
+        for batch in _batches(batchable, config.get('mecab_batch_max_bytes')):
+            batch_readings = _generate_furigana_batch(batch)
+            if batch_readings is None:
+                failed.update(batch)
+            else:
+                readings.update(zip(batch, batch_readings))
+        for text in missing:
+            if text not in readings and text not in failed:
+                readings[text] = generate_furigana(text)
+
+        furigana.update(readings)
+        furigana.update((text, '') for text in failed)
+        furigana_store.put_many({text_digest(text): reading for text, reading in readings.items()})
+
+    return furigana
+
+
 if __name__ == '__main__':
     print(generate_furigana('昨日すき焼きを食べました'))
     print(os.path.abspath('../1344485230/mecab_controller'))
@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+# Copyright: Tanaka Aiko (https://github.com/aiko-tanaka)
+# License: GNU AGPL, version 3 or later; https://www.gnu.org/licenses/agpl-3.0.en.html
+
+"""
+Per-stage timing metrics, replaces the hand-formatted speed_logger checkpoint lines
+
+Usage:
+    with metrics.stage('kanji_page_fetch'):
+        ...
+    metrics.count('okjiten_cache_hit')
+
+    speed_logger.info(metrics.summary())    # once at the end of a Regen.generate run
+
+With metrics_enabled off, stage() hands back a shared do-nothing context manager and count() returns
+right away, so the instrumentation costs an attribute check per call
+"""
+
+from .config import config
+
+from collections import Counter
+from bisect import bisect_left
+
+import threading
+import time
+
+
+# upper bounds (ms) of the histogram buckets, the last bucket is everything slower
+BUCKETS_MS = [1, 5, 10, 50, 100, 500, 1000, 5000]
+
+
+class _NoopStage:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        return False
+
+
+_NOOP_STAGE = _NoopStage()
+
+
+class _Stage:
+    __slots__ = ('metrics', 'name', 'before')
+
+    def __init__(self, metrics, name: str):
+        self.metrics    = metrics
+        self.name       = name
+
+    def __enter__(self):
+        self.before = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.metrics.observe(self.name, time.perf_counter() - self.before)
+        return False
+
+
+class Histogram:
+    __slots__ = ('count', 'total', 'max', 'buckets')
+
+    def __init__(self):
+        self.count      = 0
+        self.total      = 0.0
+        self.max        = 0.0
+        self.buckets    = [0] * (len(BUCKETS_MS) + 1)
+
+    def observe(self, seconds: float):
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        self.buckets[bisect_left(BUCKETS_MS, seconds * 1000)] += 1
+
+
+class Metrics:
+    """
+    Attributes
+    ----------
+    enabled : bool
+        metrics_enabled config
+    histograms : dict
+        stage name -> Histogram of its durations
+    counters : Counter
+        e.g. okjiten_cache_hit, okjiten_cache_miss
+    """
+    def __init__(self):
+        self.enabled    = config.get('metrics_enabled')
+        self.histograms = dict()
+        self.counters   = Counter()
+        self._lock      = threading.Lock()
+
+
+    def stage(self, name: str):
+        if not self.enabled:
+            return _NOOP_STAGE
+        return _Stage(self, name)
+
+
+    def observe(self, name: str, seconds: float):
+        if not self.enabled:
+            return
+        with self._lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram()
+            histogram.observe(seconds)
+
+
+    def count(self, name: str, n: int = 1):
+        if not self.enabled:
+            return
+        with self._lock:
+            self.counters[name] += n
+
+
+    def summary(self) -> str:
+        """
+        One line per stage (count, total, mean, max and the histogram buckets), then the counters
+        """
+        with self._lock:
+            lines = ['metrics summary']
+            header = ' | '.join('<{}ms'.format(bound) for bound in BUCKETS_MS) + ' | slower'
+            lines.append('{:<22}{:>8}{:>12}{:>12}{:>12}   {}'.format('stage', 'count', 'total s',
+                                                                    'mean ms', 'max ms', header))
+            for name, histogram in sorted(self.histograms.items()):
+                lines.append('{:<22}{:>8}{:>12.3f}{:>12.2f}{:>12.2f}   {}'.format(
+                    name,
+                    histogram.count,
+                    histogram.total,
+                    histogram.total / histogram.count * 1000,
+                    histogram.max * 1000,
+                    ' | '.join(str(bucket) for bucket in histogram.buckets)))
+
+            for name, value in sorted(self.counters.items()):
+                lines.append('{:<22}{:>8}'.format(name, value))
+
+        return '\n'.join(lines)
+
+
+    def reset(self):
+        with self._lock:
+            self.histograms.clear()
+            self.counters.clear()
+
+
+metrics = Metrics()
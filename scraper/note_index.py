@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+# Copyright: Tanaka Aiko (https://github.com/aiko-tanaka)
+# License: GNU AGPL, version 3 or later; https://www.gnu.org/licenses/agpl-3.0.en.html
+
+"""
+Kanji -> note id inverted index, kept in the kanji cache sqlite file
+
+Answers "which notes contain 夢?" without scanning every vocab field, e.g. to only re-render
+the notes of the kanji whose etymology changed (see webfinder.rerender_kanji)
+
+The index is updated incrementally: refresh() only reads the notes modified since the last refresh
+(notes.mod), whether they were added or edited in the editor, imported or synced. Every note has a row in
+note_kanji (empty for the notes without kanji), so comparing the note count of the collection with the count
+expected from the index tells whether notes were deleted, the only case where every note id is read
+Every profile has its own index, note ids are only unique inside a collection
+"""
+
+from .kanji_cache import open_cache_db, register_cache
+from .utils import extract_kanji
+from .config import config
+
+import threading
+
+
+class NoteIndex:
+    def __init__(self):
+        self._conn  = None
+        self._lock  = threading.RLock()
+        register_cache(self)
+
+
+    def _connect(self):
+        if self._conn is None:
+            self._conn = open_cache_db()
+            with self._conn:
+                # the kanji of each note, to know which rows to remove when a vocab field changes
+                self._conn.execute('CREATE TABLE IF NOT EXISTS note_kanji ('
+                                   'profile TEXT NOT NULL, '
+                                   'note_id INTEGER NOT NULL, '
+                                   'kanji TEXT NOT NULL, '
+                                   'PRIMARY KEY (profile, note_id))')
+                self._conn.execute('CREATE TABLE IF NOT EXISTS kanji_notes ('
+                                   'profile TEXT NOT NULL, '
+                                   'kanji TEXT NOT NULL, '
+                                   'note_id INTEGER NOT NULL, '
+                                   'PRIMARY KEY (profile, kanji, note_id))')
+                self._conn.execute('CREATE TABLE IF NOT EXISTS note_index_state ('
+                                   'profile TEXT PRIMARY KEY, '
+                                   'last_mod INTEGER NOT NULL, '
+                                   'note_count INTEGER)')
+                columns = [row[1] for row in self._conn.execute('PRAGMA table_info(note_index_state)')]
+                if 'note_count' not in columns:
+                    # indexes made before note_count only have rows for the notes with kanji,
+                    # a NULL note_count makes the next refresh() index every note again
+                    self._conn.execute('ALTER TABLE note_index_state ADD COLUMN note_count INTEGER')
+        return self._conn
+
+
+    @staticmethod
+    def _vocab_field_ords(col) -> dict:
+        """
+        Returns:
+            note type id -> position of the vocab field, for the note types that have one
+        """
+        vocab_field = config.get('vocab_field')
+        ords = dict()
+        for model in col.models.all():
+            names = [field['name'] for field in model['flds']]
+            if vocab_field in names:
+                ords[model['id']] = names.index(vocab_field)
+        return ords
+
+
+    def refresh(self, col, profile: str) -> int:
+        """
+        Indexes the notes added or modified since the last refresh, main thread only (reads the collection)
+        Returns:
+            number of notes (re)indexed
+        """
+        with self._lock:
+            conn = self._connect()
+            row = conn.execute('SELECT last_mod, note_count FROM note_index_state WHERE profile = ?',
+                               (profile,)).fetchone()
+            last_mod, note_count = row if row and row[1] is not None else (0, 0)
+
+            ords = self._vocab_field_ords(col)
+            # >= since several notes can be modified within the same second
+            rows = col.db.all('SELECT id, mid, mod, flds FROM notes WHERE mod >= ?', last_mod)
+
+            old_kanji = self._indexed_kanji(conn, profile, [note_id for note_id, mid, mod, fields in rows])
+            # the notes not indexed yet were added since the last refresh
+            note_count += sum(1 for note_id, mid, mod, fields in rows if note_id not in old_kanji)
+
+            deleted = dict()
+            if col.db.scalar('SELECT COUNT() FROM notes') != note_count:
+                existing = set(col.db.list('SELECT id FROM notes'))
+                deleted = {note_id: kanji for note_id, kanji in
+                           conn.execute('SELECT note_id, kanji FROM note_kanji WHERE profile = ?', (profile,))
+                           if note_id not in existing}
+                note_count = len(existing)
+
+            with conn:
+                for note_id, kanji in deleted.items():
+                    self._set_note_kanji(conn, profile, note_id, kanji, None)
+
+                for note_id, mid, mod, fields in rows:
+                    last_mod = max(last_mod, mod)
+                    kanji = ''
+                    if mid in ords:
+                        kanji = ''.join(extract_kanji(fields.split('\x1f')[ords[mid]]) or [])
+                    if kanji != old_kanji.get(note_id):
+                        self._set_note_kanji(conn, profile, note_id, old_kanji.get(note_id, ''), kanji)
+
+                conn.execute('INSERT OR REPLACE INTO note_index_state (profile, last_mod, note_count) '
+                             'VALUES (?, ?, ?)', (profile, last_mod, note_count))
+
+        return len(rows)
+
+
+    @staticmethod
+    def _indexed_kanji(conn, profile: str, note_ids: list) -> dict:
+        """
+        Returns:
+            note id -> indexed kanji, for the given note ids that are already indexed
+        """
+        indexed = dict()
+        # under SQLITE_MAX_VARIABLE_NUMBER of older sqlite versions (999)
+        for start in range(0, len(note_ids), 500):
+            chunk = note_ids[start:start + 500]
+            placeholders = ', '.join('?' for note_id in chunk)
+            indexed.update(conn.execute(f'SELECT note_id, kanji FROM note_kanji '
+                                        f'WHERE profile = ? AND note_id IN ({placeholders})', [profile] + chunk))
+        return indexed
+
+
+    @staticmethod
+    def _set_note_kanji(conn, profile: str, note_id: int, old_kanji: str, kanji: str = None):
+        """
+        kanji is None for a deleted note
+        """
+        removed = set(old_kanji) - set(kanji or '')
+        added   = set(kanji or '') - set(old_kanji)
+
+        conn.executemany('DELETE FROM kanji_notes WHERE profile = ? AND kanji = ? AND note_id = ?',
+                         [(profile, k, note_id) for k in removed])
+        conn.executemany('INSERT OR IGNORE INTO kanji_notes (profile, kanji, note_id) VALUES (?, ?, ?)',
+                         [(profile, k, note_id) for k in added])
+
+        if kanji is None:
+            conn.execute('DELETE FROM note_kanji WHERE profile = ? AND note_id = ?', (profile, note_id))
+        else:
+            conn.execute('INSERT OR REPLACE INTO note_kanji (profile, note_id, kanji) VALUES (?, ?, ?)',
+                         (profile, note_id, kanji))
+
+
+    def notes_with_kanji(self, kanji_list, profile: str) -> list:
+        """
+        Returns:
+            sorted ids of the notes whose vocab contains any of the kanji
+        """
+        kanji_list = list(kanji_list)
+        if not kanji_list:
+            return []
+
+        with self._lock:
+            placeholders = ', '.join('?' for kanji in kanji_list)
+            rows = self._connect().execute(f'SELECT DISTINCT note_id FROM kanji_notes '
+                                           f'WHERE profile = ? AND kanji IN ({placeholders}) ORDER BY note_id',
+                                           [profile] + kanji_list).fetchall()
+        return [row[0] for row in rows]
+
+
+    def commit(self):
+        # every refresh() is its own transaction, nothing is pending
+        pass
+
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+note_index = NoteIndex()
@@ -17,7 +17,8 @@ from .utils import calculate_time
 
 from .config import config
 
-import urllib.request
+import http.client
+import threading
 import json
 import os
 
@@ -25,9 +26,8 @@ import os
 def request(action, **params):
     return {'action': action, 'params': params, 'version': 6}
 
-def invoke(action, **params):
-    requestJson = json.dumps(request(action, **params)).encode('utf-8')
-    response = json.load(urllib.request.urlopen(urllib.request.Request('http://localhost:8765', requestJson)))
+
+def check_response(response: dict):
     if len(response) != 2:
         raise Exception('response has an unexpected number of fields')
     if 'error' not in response:
@@ -40,6 +40,59 @@ def invoke(action, **params):
     return response['result']
 
 
+class AnkiConnect:
+    """
+    Keep-alive connection to AnkiConnect, reused by every query instead of opening one per request
+    """
+    def __init__(self, host='localhost', port=8765):
+        self.host       = host
+        self.port       = port
+        self._conn      = None
+        self._lock      = threading.Lock()
+
+
+    def _post(self, body: bytes) -> dict:
+        with self._lock:
+            # a kept-alive connection can be closed by the server at any time, reconnect once if it was
+            for attempt in range(2):
+                if self._conn is None:
+                    self._conn = http.client.HTTPConnection(self.host, self.port, timeout=10)
+                try:
+                    self._conn.request('POST', '/', body, {'Content-Type': 'application/json'})
+                    return json.loads(self._conn.getresponse().read())
+                except (http.client.HTTPException, OSError):
+                    self._conn.close()
+                    self._conn = None
+                    if attempt: raise
+
+
+    def invoke(self, action, **params):
+        requestJson = json.dumps(request(action, **params)).encode('utf-8')
+        return check_response(self._post(requestJson))
+
+
+    def multi(self, actions: list) -> list:
+        """
+        Runs many actions (made with request()) in a single round trip through AnkiConnect's multi action
+        Returns:
+            the result of each action, in order, None for the actions that failed
+        """
+        results = []
+        for result in self.invoke('multi', actions=actions):
+            # version 6 wraps every result inside {'result': ..., 'error': ...}
+            if isinstance(result, dict) and set(result.keys()) == {'result', 'error'}:
+                result = result['result'] if result['error'] is None else None
+            results.append(result)
+        return results
+
+
+anki_connect = AnkiConnect()
+
+
+def invoke(action, **params):
+    return anki_connect.invoke(action, **params)
+
+
 decks = ['全集Deck::01_All_in_One_Kanji',
          '全集Deck::02_KanjiKentei',
          '全集Deck::03_KanjiDamage',]
@@ -47,10 +100,78 @@ decks = ['全集Deck::01_All_in_One_Kanji',
 lookalikes = '全集Deck::04_Kanji_lookalikes'
 
 
+def _kanji_info_actions(kanji: str) -> list:
+    """
+    one goldenCardsInfo action per deck in decks, then one for the lookalikes deck
+    """
+    actions = [request('goldenCardsInfo',
+                       query=f'deck:{deck} kanji:*{kanji}*',
+                       desiredFields='Kanji Meaning Components Examples')
+               for deck in decks]
+    actions.append(request('goldenCardsInfo',
+                           query=f'deck:{lookalikes} kanji:*{kanji}*',
+                           desiredFields='Kanji Memrise_Look_Alike_Kanji'))
+    return actions
+
+
+def _kanji_info_from_results(kanji: str, deck_results: list, lookalikes_query: list) -> dict:
+    kanji_info = dict()
+    # the first deck (in the order of decks) that has the kanji wins, the next ones are only read if it doesn't
+    deck_result = next((result for result in deck_results if result), None) or []
+    for res in deck_result:
+        fields: dict = res['fields']
+        kanji_info['kanji'] = kanji
+        kanji_info['meaning'] = fields['Meaning']['value']
+        try: kanji_info['components'] = fields['Components']['value']
+        except KeyError: kanji_info['components'] = ''
+        try: kanji_info['examples'] = fields['Examples']['value']
+        except KeyError: kanji_info['examples'] = ''
+
+    kanji_info['lookalikes'] = ''
+    if lookalikes_query:
+        for res in lookalikes_query:
+            fields: dict = res['fields']
+            try: kanji_info['lookalikes'] = fields['Memrise_Look_Alike_Kanji']['value']
+            except KeyError: kanji_info['lookalikes'] = ''
+
+    return kanji_info
+
+
+@calculate_time
+def offline_kanji_info_batch(kanji_list: list) -> dict:
+    """
+    Cross-Profile query for the Kanji Info of many kanji at once
+
+    All the goldenCardsInfo queries of the whole list go through AnkiConnect's multi action,
+    ankiconnect_batch_size queries per request, so the number of requests doesn't grow with every kanji
+    Returns:
+        kanji -> kanji info (see offline_kanji_info)
+    """
+    kanji_list = list(dict.fromkeys(kanji_list))
+
+    actions = []
+    for kanji in kanji_list:
+        actions.extend(_kanji_info_actions(kanji))
+
+    batch_size = config.get('ankiconnect_batch_size')
+    results = []
+    for start in range(0, len(actions), batch_size):
+        results.extend(anki_connect.multi(actions[start:start + batch_size]))
+
+    per_kanji = len(decks) + 1
+    kanji_info_dict = dict()
+    for index, kanji in enumerate(kanji_list):
+        kanji_results = results[index * per_kanji:(index + 1) * per_kanji]
+        kanji_info_dict[kanji] = _kanji_info_from_results(kanji, kanji_results[:-1], kanji_results[-1])
+
+    return kanji_info_dict
+
+
 @calculate_time
 def offline_kanji_info(kanji: str) -> dict:
     """
     Cross-Profile query for Kanji Info
+    (a single AnkiConnect request, see offline_kanji_info_batch)
 
     Returns:
         All kanji will have all four keys, but some may have empty values
@@ -64,37 +185,49 @@ def offline_kanji_info(kanji: str) -> dict:
             'examples': ''
         }
     """
+    return offline_kanji_info_batch([kanji])[kanji]
 
-    kanji_info = dict()
-    for deck in decks:
-        query = f'deck:{deck} kanji:*{kanji}*'
-        result = invoke('goldenCardsInfo',
-                        query=query,
-                        desiredFields='Kanji Meaning Components Examples')
-        if result:
-            for res in result:
-                fields: dict = res['fields']
-                kanji_info['kanji'] = kanji
-                kanji_info['meaning'] = fields['Meaning']['value']
-                try: kanji_info['components'] = fields['Components']['value']
-                except KeyError: kanji_info['components'] = ''
-                try: kanji_info['examples'] = fields['Examples']['value']
-                except KeyError: kanji_info['examples'] = ''
-            break
-
-    query = f'deck:{lookalikes} kanji:*{kanji}*'
-    lookalikes_query = invoke('goldenCardsInfo',
-                              query=query,
-                              desiredFields='Kanji Memrise_Look_Alike_Kanji')
 
-    kanji_info['lookalikes'] = ''
-    if lookalikes_query:
-        for res in lookalikes_query:
-            fields: dict = res['fields']
-            try: kanji_info['lookalikes'] = fields['Memrise_Look_Alike_Kanji']['value']
-            except KeyError: kanji_info['lookalikes'] = ''
+# in-memory copy of the KANJIDIC bank, loaded once per session by load_kanjidic2()
+_kanjidic2 = {
+    'path':     None,
+    'mtime':    None,
+    'data':     dict(),
+}
+_kanjidic2_lock = threading.Lock()
 
-    return kanji_info
+
+def load_kanjidic2() -> dict:
+    """
+    Lazily loads the KANJIDIC bank ({kanji: definition}) and keeps it in memory
+    The file is only parsed again if its path changes or, if kanjidic_check_mtime is set,
+    if the file was modified since it was last loaded
+    """
+    complete_path = os.path.join(config.get('kanjidic_folder'), config.get('kanjidic_filename'))
+
+    # the scraping threads can all ask for it at the same time, only load it once
+    with _kanjidic2_lock:
+        if _kanjidic2['path'] == complete_path:
+            if not config.get('kanjidic_check_mtime'):
+                return _kanjidic2['data']
+            try:
+                if os.path.getmtime(complete_path) == _kanjidic2['mtime']:
+                    return _kanjidic2['data']
+            except OSError:
+                return _kanjidic2['data']
+
+        data = dict()
+        mtime = None
+        if os.path.isfile(complete_path):
+            mtime = os.path.getmtime(complete_path)
+            with open(complete_path, 'r', encoding='utf8') as fh:
+                data = json.load(fh)
+
+        _kanjidic2['path']  = complete_path
+        _kanjidic2['mtime'] = mtime
+        _kanjidic2['data']  = data
+
+        return data
 
 
 @calculate_time
@@ -102,16 +235,8 @@ def kanjidic2_info(kanji: str) -> str or None:
     """
     Only return a single-line English definition str
     """
-    complete_path = os.path.join(config.get('kanjidic_folder'), config.get('kanjidic_filename'))
     # complete_path = r'D:\Libraries\Documents\GitHub\KanjiEtymology\scraper\kanji_bank_complete-dict-format.json'
-    if os.path.isfile(complete_path):
-        with open(complete_path, 'r', encoding='utf8') as fh:
-            data: dict = json.load(fh)
-
-            result = data.get(kanji, '')
-            if result: return result
-    else:
-        return None
+    return load_kanjidic2().get(kanji) or None
 
 
 # TODO: query the kanjigen JSON file if the kanji isn't listed on okjiten
@@ -7,57 +7,212 @@ Online dictionaries and their respective JSON cache methods (if there are any)
 """
 
 from .utils import try_access_site, calculate_time, speed_logger
-from .offline_dictionaries import kanjidic2_info, offline_kanji_info
+from .offline_dictionaries import kanjidic2_info, offline_kanji_info, offline_kanji_info_batch
+from .kanji_cache import KeyedCache
+from .metrics import metrics
+from .parsers import parse_okjiten_index, parse_okjiten_kanji_page, parse_tangorin_meanings, parse_dong_page
 from .config import config
 
-from bs4 import BeautifulSoup
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 
 import urllib.request
 import urllib.parse
+import threading
 import time
 import json
 import os
 
+# keyed sqlite cache of the tangorin definitions, kanji -> {'definition': str}
+# kanji that tangorin doesn't know are saved as negative entries, {'definition': ''}
+tangorin_store = KeyedCache('tangorin')
+
+# kanji whose tangorin lookup failed (site unreachable) during the current run, not saved to disk
+# cleared at the end of every run by clear_failed_lookups(), the circuit breaker covers longer outages
+_tangorin_failed = set()
+
+
+def clear_failed_lookups():
+    """
+    Lets the next run ask tangorin again for the kanji whose lookup failed during this one
+    """
+    _tangorin_failed.clear()
+
+
 @calculate_time
 def tangorin_kanji_info(kanji: str) -> str:
     """
     Usage:
         To be used inside okjiten_etymology
+        Definitions are cached for tangorin_cache_days, misses for tangorin_negative_cache_days
     Args:
         Takes in a single kanji ONLY, not a list
     Returns:
         str: The english definition for the specified Kanji
     """
+    entry = tangorin_store.get_entry(kanji)
+    if entry:
+        cached, updated_at = entry
+        max_age = config.get('tangorin_cache_days') if cached.get('definition') \
+                  else config.get('tangorin_negative_cache_days')
+        if time.time() - updated_at < max_age * 24 * 60 * 60:
+            metrics.count('tangorin_cache_hit')
+            return cached.get('definition', '')
+    metrics.count('tangorin_cache_miss')
+
+    # don't wait for tangorin twice in the same run if it's unreachable
+    if kanji in _tangorin_failed:
+        return ''
+
     response = try_access_site(site='https://tangorin.com/kanji?search={}'
                                .format(urllib.parse.quote(kanji.encode('utf-8'))),
                                num_retries=1,
                                wait_time=4.0,
                                timeout=1.5)
-    if response:
-        soup = BeautifulSoup(response, features='html.parser')
-    else:
-        return ''
-    if soup:
-        en_definitions = soup.find('p', attrs={'class':  'k-meanings'})
-    else:
+    if not response:
+        _tangorin_failed.add(kanji)
         return ''
+
+    en_definitions = parse_tangorin_meanings(response)
     if en_definitions:
-        en_definitions = en_definitions.get_text().strip()
-    else:
-        return ''
+        # limit num of definitions to only 3 definitions
+        en_definitions = '; '.join(en_definitions.split('; ')[:3])
+
+    # a miss is saved as well, as a negative entry
+    tangorin_store.put(kanji, {'definition': en_definitions})
+
+    return en_definitions
+
+
+def _ankiconnect_meaning(kanji: str) -> str:
+    kanji_info = offline_kanji_info(kanji) or dict()
+    return kanji_info.get('meaning', '')
 
+
+# the definition sources, highest priority first
+DEFINITION_SOURCES = [
+    ('kanjidic2',   kanjidic2_info),
+    ('tangorin',    tangorin_kanji_info),
+    ('ankiconnect', _ankiconnect_meaning),
+]
+
+_definition_executor = None
+_definition_executor_lock = threading.Lock()
+
+
+def _lookup_definition(lookup, kanji: str) -> str:
     try:
-        en_definitions = en_definitions.split('; ')
-        # limit num of definitions to only 3 definitions
-        if len(en_definitions) > 3:
-            en_definitions = en_definitions[:3]
-            en_definitions = '; '.join(en_definitions)
+        return lookup(kanji) or ''
+    except Exception:
+        return ''
+
+
+def resolve_definition(kanji: str, exclude=()) -> (str, str or None):
+    """
+    Hedged lookup through DEFINITION_SOURCES (minus the ones named in exclude)
+    The first source starts right away, each next one starts after definition_hedge_delay seconds
+    (or as soon as every source before it came back empty). The answer of the highest priority source is taken
+    once all the sources before it came back empty, and at definition_deadline seconds the best answer so far is
+    taken, so a slow tangorin doesn't hold up the AnkiConnect lookup. Lookups still running at the deadline finish
+    in the background, tangorin still saves its answer to its cache.
+
+    Returns:
+        (definition, name of the source it came from) or ('', None)
+    """
+    global _definition_executor
+    with _definition_executor_lock:
+        if _definition_executor is None:
+            _definition_executor = ThreadPoolExecutor(max_workers=config.get('scraper_workers') * len(DEFINITION_SOURCES))
+
+    sources     = [source for source in DEFINITION_SOURCES if source[0] not in exclude]
+    hedge_delay = config.get('definition_hedge_delay')
+    deadline    = time.monotonic() + config.get('definition_deadline')
+
+    futures     = dict()    # future -> priority
+    results     = dict()    # priority -> definition
+    last_start  = 0.0
+
+    while True:
+        for future in futures:
+            if future.done():
+                results[futures[future]] = future.result()
+
+        # the highest priority answer, as long as every source before it is done
+        for priority in range(len(sources)):
+            if priority not in results:
+                break
+            if results[priority]:
+                return _definition_won(results[priority], sources[priority][0])
         else:
-            en_definitions = '; '.join(en_definitions)
-    except:
-        pass
+            # every source came back empty
+            return '', None
+
+        now = time.monotonic()
+        if now >= deadline:
+            break
+
+        started = len(futures)
+        if started < len(sources):
+            # no answer yet: the next source starts once every source before it came back empty,
+            # or once the hedge delay is over
+            if len(results) == started or now - last_start >= hedge_delay:
+                future = _definition_executor.submit(_lookup_definition, sources[started][1], kanji)
+                futures[future] = started
+                last_start = now
+                continue
+
+        timeout = deadline - now
+        if started < len(sources):
+            timeout = min(timeout, last_start + hedge_delay - now)
+        wait([future for future in futures if not future.done()], timeout=timeout, return_when=FIRST_COMPLETED)
+
+    # deadline, the best answer that arrived
+    metrics.count('definition_deadline_hit')
+    for priority in sorted(results):
+        if results[priority]:
+            return _definition_won(results[priority], sources[priority][0])
+    return '', None
+
+
+def _definition_won(definition: str, name: str) -> (str, str):
+    metrics.count('definition_source_' + name)
+    return definition, name
 
-    return en_definitions if en_definitions else ''
+
+# keyed sqlite cache of the dong-chinese records, same kind of cache as okjiten_store
+# kanji -> {'found': bool, 'hint': ..., 'definition': ..., 'components': [...]}
+dong_store = KeyedCache('dong')
+
+
+def dong_kanji_info(kanji: str) -> dict or None:
+    """
+    Structured dong-chinese record of a single kanji, scraped once then served from dong_store
+    Characters that dong-chinese doesn't know are cached as well, as {'found': False}
+    (new records are written to disk on commit_caches(), like the okjiten ones)
+    Returns:
+        the record, None if dong-chinese couldn't be reached
+    """
+    record = dong_store.get(kanji)
+    if record is not None:
+        metrics.count('dong_cache_hit')
+        return record
+    metrics.count('dong_cache_miss')
+
+    site = f'https://www.dong-chinese.com/dictionary/{urllib.parse.quote(kanji.encode("utf-8"))}'
+
+    # try waiting for a while if website returns an error
+    response = try_access_site(site=site)
+    if not response:
+        return None
+
+    # get only the relevant JS part of dong-chinese which is formatted as a JSON
+    record = parse_dong_page(response)
+    if record is None:
+        return None
+
+    record['kanji'] = kanji
+    dong_store.put(kanji, record)
+
+    return record
 
 
 @calculate_time
@@ -73,116 +228,65 @@ def dong_etymology(kanji_set):
     """
     full_etymology_list = ''
     for kanji in kanji_set:
+        record = dong_kanji_info(kanji)
+
+        # not found or an error, i.e. nothing was found inside dong
+        if not record or not record.get('found'):
+            continue
+
+        definition      = record.get('definition')
+        etymology       = record.get('hint')
+        decomposition   = record.get('components')
+
+        # concatenate the strings
+        concat_str = '<b>{}</b>'.format(kanji)
+        full_etymology_list += concat_str
+
+        if definition:
+            add_str = '({}): '.format(definition)
+            full_etymology_list += add_str
+        else:
+            full_etymology_list += ': '
+
+        if etymology:
+            full_etymology_list += etymology
+
+        # decomposition is a list of DICT objects
+        # e.g. "components":[  {"character":"木","type":["iconic"],"hint":null},
+        # {"character":"◎","type":["iconic"],"hint":"Depicts roots."}   ]
+        if decomposition:
+            for decom in decomposition:
+                char = str(decom.get('character', ''))
+                func = str(decom.get('type', ''))
+                hint = str(decom.get('hint', ''))
+
+                add_str_decom = ' [{}-{}-{}]'.format(char, func, hint)
+                full_etymology_list += add_str_decom
 
-        site = f'https://www.dong-chinese.com/dictionary/{urllib.parse.quote(kanji.encode("utf-8"))}'
-
-        # try waiting for a while if website returns an error
-        response = ''
-        response = try_access_site(site=site, sleep_time=0.05)
-
-        soup = BeautifulSoup(response, features='html.parser')
-        soup_text = str(soup)
-
-        # get only the relevant JS part of dong-chinese which is formatted as a JSON
-        soup_text = soup_text.split('<script>window["')[-1].split('__sink__charData_')[-1].split(']=')[-1]
-        # returns a pure JSON object
-        soup_text = soup_text.split(';</script>')[0]
-
-        dong_text_not_found = '"error":"Word not found"'
-
-        # not and error, i.e. something was actually found inside dong
-        if not(dong_text_not_found in soup_text):
-            # turn into JSON and parse
-            soup_json = json.loads(soup_text)
-
-            try:
-                etymology = soup_json['hint']
-            # usually KeyError
-            except Exception as e:
-                etymology = ''
-
-            try:
-                # <div class="MuiGrid-root MuiGrid-item MuiGrid-grid-xs-12" style="padding:8px">
-                definition = soup.find('div',
-                                       attrs={'class': 'MuiGrid-root MuiGrid-item MuiGrid-grid-xs-12',
-                                              'style': 'padding:8px'} )
-                definition = str(definition).split('<span><span><span>')[-1].split('</span></span><a href=')[0]
-
-                # get only one keyword from the many keywords separated by ; and or ,
-                if ';' in definition:
-                    definition = definition.split('; ')[0]
-                    if ',' in definition:
-                        definition = definition.split(', ')[0]
-                elif ',' in definition:
-                    definition = definition.split(', ')[0]
-
-            except Exception as e:
-                definition = ''
-
-            try:
-                decomposition = soup_json['components']
-            except Exception as e:
-                decomposition = ''
-
-
-            # concatenate the strings
-            concat_str = '<b>{}</b>'.format(kanji)
-            full_etymology_list += concat_str
-
-            if definition:
-                add_str = '({}): '.format(definition)
-                full_etymology_list += add_str
-            else:
-                full_etymology_list += ': '
-
-            if etymology:
-                full_etymology_list += etymology
-
-            # decomposition is a list of DICT objects
-            # e.g. "components":[  {"character":"木","type":["iconic"],"hint":null},
-            # {"character":"◎","type":["iconic"],"hint":"Depicts roots."}   ]
-            if decomposition:
-                # decom_json_list = [json.loads(decom) for decom in decomposition]
-                for decom in decomposition:
-                    try:
-                        char = str(decom['character'])
-                    except Exception as e:
-                        char =''
-
-                    try:
-                        func = str(decom['type'])
-                    except Exception as e:
-                        func = ''
-
-                    try:
-                        hint = str(decom['hint'])
-                    except:
-                        hint = ''
-
-                    add_str_decom = ' [{}-{}-{}]'.format(char, func, hint)
-                    full_etymology_list += add_str_decom
-
-            # \n when testing inside pycharm, <br> when inside Anki
-
-            full_etymology_list += '<br>'
-            if __name__ == '__main__':
-                full_etymology_list += '\n'
+        # \n when testing inside pycharm, <br> when inside Anki
+
+        full_etymology_list += '<br>'
+        if __name__ == '__main__':
+            full_etymology_list += '\n'
 
     # print(full_etymology_list)
     return full_etymology_list
 
 
+# keyed sqlite cache of the okjiten kanji info, see kanji_cache.py
+# the old okjiten_cache.json is imported into it the first time it's used
+okjiten_store = KeyedCache('okjiten', legacy_json_key='okjiten_cache_filename')
+
+
 @calculate_time
 def okjiten_cache(kanji: str = None,
                   kanji_info_to_save: dict = None,
                   save_to_dict = False) -> dict or None:
     """
-    JSON dict cache
+    Keyed okjiten cache
 
-    File formatting:
-    The key is the okjiten site index (NOT ANYMORE)
-
-    Just use the kanji itself as the key, they're unique anyway
+    Formatting:
+    The key is the kanji itself, they're unique anyway
     {
         '夢':     {
                     'kanji': '夢',
@@ -193,81 +297,145 @@ def okjiten_cache(kanji: str = None,
         .....
     }
 
-    checks if a certain kanji's okjiten formatting is already inside the JSON dict
+    checks if a certain kanji's okjiten formatting is already inside the cache
     If there is, then return it
 
-    If there isn't then, wait for the querying to finish and sive it inside the JSON
+    If there isn't then, wait for the querying to finish and save it inside the cache
+    Saved entries are only written to disk on commit_caches() (once per Regen.generate run)
     Args:
         kanji
         kanji_info_to_save: dict of the kanji info to save
-        mode:               (mode 1 = check, mode 2 = write)
+        save_to_dict:       (False = check, True = write)
     Returns:
-        if mode 1:      JSON-formatted okjiten definition
-        if mode 2:      none (only saves the JSON to the dictionary)
+        if check:       okjiten kanji info dict or None
+        if write:       none (only queues the kanji info to be saved)
     """
-    kanji_cache_path        = config.get('kanji_cache_path')
-    okjiten_cache_filename  = config.get('okjiten_cache_filename')
-
-    # TODO: overwrite specific kanji info if update is set to true
-    force_update            = config.get('force_update')
-    full_path               = os.path.join(kanji_cache_path, okjiten_cache_filename)
-
-    # create a JSON file if it doesn't exist
-    if not os.path.isfile(full_path):
-        with open(full_path, 'w') as fh:
-            json.dump({}, fh)
-
     # (mode 2)
     if save_to_dict:
-        json_formatted_info = {
-            kanji: kanji_info_to_save
-        }
-
-        # https://stackoverflow.com/questions/18980039/how-to-append-in-a-json-file-in-python
-        with open(full_path, 'r', encoding='utf8') as fh:
-            data: dict = json.load(fh)
-
-        # https://www.programiz.com/python-programming/methods/dictionary/update
-        # https://stackoverflow.com/questions/29694826/updating-a-dictionary-in-python
-        # you can use a tuple to update a dict with key-val pairs
-        try: data.pop(kanji)
-        except KeyError: pass
-        data.update( json_formatted_info )
-
-        # https://stackoverflow.com/questions/18337407/saving-utf-8-texts-with-json-dumps-as-utf8-not-as-u-escape-sequence
-        with open(full_path, 'w', encoding='utf8') as fh:
-            json.dump(data,
-                      fh,
-                      indent=4,
-                      ensure_ascii=False,
-                      separators=(',', ': '))
+        okjiten_store.put(kanji, kanji_info_to_save)
 
     # (mode 1)
     else:
-        # check cache if the kanji exists, if it does, return it
+        return okjiten_store.get(kanji) or None
+
+
+OKJITEN_INDEX_PAGES = ['https://okjiten.jp/10-jyouyoukanjiitiran.html',
+                       'https://okjiten.jp/8-jouyoukanjigai.html',  # (kanken pre-1 and 1)
+                       'https://okjiten.jp/9-jinmeiyoukanji.html']
+
+# in-memory copy of the okjiten index map, loaded once per session by okjiten_index()
+# incomplete: one of the index pages couldn't be reached and there was no saved map to fall back on,
+# the kanji it doesn't list may still be on okjiten (see okjiten_listed)
+_okjiten_index: dict or None = None
+_okjiten_index_incomplete = False
+_okjiten_index_lock = threading.Lock()
+
+
+@calculate_time
+def build_okjiten_index() -> (dict, bool):
+    """
+    Scrapes the three okjiten index pages and maps every kanji listed in them
+    to the index page it was found on and the href of its kanji page
+
+    {
+        '夢':     ['https://okjiten.jp/10-jyouyoukanjiitiran.html', 'kanji1234.html'],
+        .....
+    }
 
-        # the return is none, pass 'True' inside okjiten_cache(save_to_dict)
-        # from where it is called
+    Returns:
+        (index map, complete), complete is False if one of the index pages couldn't be reached
+    """
+    index = dict()
+    complete = True
+
+    for site in OKJITEN_INDEX_PAGES:
+        with metrics.stage('index_fetch'):
+            response = try_access_site(site)
+        if not response:
+            complete = False
+            continue
+
+        with metrics.stage('parse'):
+            links = parse_okjiten_index(response)
+        for text, href in links:
+            # the same kanji can be listed on more than one page, keep the first one (same order as before)
+            if text not in index:
+                index[text] = [site, href]
+
+    return index, complete
+
+
+def okjiten_index(refresh: bool = False) -> dict:
+    """
+    kanji -> [index page, kanjiNNNN.html href] map
+
+    Built once from the okjiten index pages then saved next to the okjiten cache,
+    the saved map is only rebuilt if refresh is True or if it's older than okjiten_index_max_age_days
+    An incomplete (or empty) build is kept for the rest of the session as well, so that okjiten being down
+    doesn't mean building it again for every kanji, okjiten_listed() tells which kanji it can't vouch for
+    """
+    global _okjiten_index, _okjiten_index_incomplete
+    if _okjiten_index is not None and not refresh:
+        return _okjiten_index
+
+    with _okjiten_index_lock:
+        # another scraping thread might have loaded it while this one was waiting
+        if _okjiten_index is not None and not refresh:
+            return _okjiten_index
+
+        index, complete = _load_okjiten_index(refresh)
+        _okjiten_index, _okjiten_index_incomplete = index, not complete
+
+    return _okjiten_index
+
+
+def okjiten_listed(kanji: str) -> bool or None:
+    """
+    Returns:
+        True if the kanji is on okjiten, False if it isn't,
+        None if the index is incomplete and doesn't list it (it might be on one of the unreachable index pages)
+    """
+    if kanji in okjiten_index():
+        return True
+    return None if _okjiten_index_incomplete else False
+
+
+def _load_okjiten_index(refresh: bool) -> (dict, bool):
+    """
+    Returns:
+        (index map, complete), a saved map counts as complete even if it's stale
+    """
+    full_path   = os.path.join(config.get('kanji_cache_path'), config.get('okjiten_index_filename'))
+    max_age     = config.get('okjiten_index_max_age_days') * 24 * 60 * 60
+
+    is_saved    = os.path.isfile(full_path)
+    is_stale    = is_saved and time.time() - os.path.getmtime(full_path) > max_age
+
+    if is_saved and not (refresh or is_stale):
         try:
             with open(full_path, 'r', encoding='utf8') as fh:
-                try:
-                    cache: dict = json.load(fh)
+                return json.load(fh), True
+        except json.decoder.JSONDecodeError:
+            pass
 
-                    result = cache.get(kanji)
-                    if result:
-                        return result
-                    else:
-                        return None
+    index, complete = build_okjiten_index()
 
-                except json.decoder.JSONDecodeError:
-                    return None
-        except:
-            raise
+    if complete:
+        with open(full_path, 'w', encoding='utf8') as fh:
+            json.dump(index, fh, ensure_ascii=False)
+    elif is_saved:
+        # okjiten is (partially) unreachable, a stale map is better than an incomplete one
+        try:
+            with open(full_path, 'r', encoding='utf8') as fh:
+                return json.load(fh), True
+        except json.decoder.JSONDecodeError:
+            pass
 
+    return index, complete
 
 
 @calculate_time
-def okjiten_etymology(kanji_set: list) -> list:
+def okjiten_etymology(kanji_set: list, max_workers: int = None, cancelled: threading.Event = None) -> list:
     """
     Usage: okjiten_etymology(extract_kanji(sample_vocab))
 
@@ -285,10 +453,13 @@ def okjiten_etymology(kanji_set: list) -> list:
         etc...
 
     Args:
-        List/Set of Kanji
+        kanji_set:      List/Set of Kanji
+        max_workers:    number of kanji scraped concurrently, defaults to the scraper_workers config
+                        1 scrapes them one at a time
+        cancelled:      once set, the kanji not started yet are skipped (left out of the result)
 
     Returns:
-        LIST of JSONs/Dicts
+        LIST of JSONs/Dicts (same order as kanji_set)
         each JSON/dict containing: (as dict properties)
             name/kanji itself       :   kanji
             definition              :   kanji definition
@@ -301,218 +472,216 @@ def okjiten_etymology(kanji_set: list) -> list:
             bushu
     """
 
-    result_list = []
+    max_workers = max_workers or config.get('scraper_workers')
 
-    for kanji in kanji_set:
-        initial_time = time.time()
-        speed_logger.info(f'--- (1) START K:{kanji} initial time : 0 ---')
+    # each kanji is independent of the others, so their 2-4 round trips can overlap
+    # try_access_site caps how many of them can hit the same host at once
+    # executor.map keeps the results in the same order as kanji_set
+    def scrape(kanji):
+        if cancelled is not None and cancelled.is_set():
+            return None
+        # the AnkiConnect fallback is left out of the per-kanji lookups, see _ankiconnect_definitions()
+        return okjiten_kanji_info(kanji, ankiconnect=False)
 
-        indiv_kanji_info = dict()
+    if max_workers > 1 and len(kanji_set) > 1:
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(kanji_set))) as executor:
+            kanji_info_list = list(executor.map(scrape, kanji_set))
+    else:
+        kanji_info_list = [scrape(kanji) for kanji in kanji_set]
 
-        cache: dict = okjiten_cache(kanji, save_to_dict=False)
-        # checks that cache isn't empty and that all cache items have a value
-        # if at least one key doesn't have a value, the program will continue in order
-        # for the cache to be updated
+    result_list = [kanji_info for kanji_info in kanji_info_list if kanji_info]
+    if cancelled is None or not cancelled.is_set():
+        _ankiconnect_definitions(result_list)
 
-        # if len != 9, then some info might be missing so update the missing info
-        if cache is not None and all(cache.values()) and len(cache) == 9:
-            result_list.append(cache)
-            continue
-        speed_logger.info(f'--- after cache : {time.time() - initial_time} ---')
+    # print(result_dict['online_img_url'])
+    return result_list
 
-        sites= ['https://okjiten.jp/10-jyouyoukanjiitiran.html',
-                'https://okjiten.jp/8-jouyoukanjigai.html', # (kanken pre-1 and 1)
-                'https://okjiten.jp/9-jinmeiyoukanji.html']
 
-        for site in sites:
-            original_site = site
-            try: site = cache.get('scraped_from') if cache else original_site
-            except AttributeError: site = original_site
+def _ankiconnect_definitions(kanji_info_list: list):
+    """
+    Fills in the definition of the kanji that neither kanjidic2 nor tangorin could define
+    with a single offline_kanji_info_batch() query, instead of one AnkiConnect request per kanji
+    """
+    missing = [kanji_info for kanji_info in kanji_info_list if not kanji_info.get('definition')]
+    if not missing:
+        return
 
-            response = ''
-            response = try_access_site(site)
-            if not response: continue
-            speed_logger.info(f'--- (2) K:{kanji} after response = try_access_site({site})'
-                              f' : {round(time.time() - initial_time, 5)} ---')
-
-            soup = BeautifulSoup(response, features='html.parser')
-            if kanji in str(soup) and soup:
+    try:
+        with metrics.stage('definition_chain'):
+            offline_info = offline_kanji_info_batch([kanji_info['kanji'] for kanji_info in missing])
+    except Exception:
+        # AnkiConnect isn't running, the definitions stay empty and are looked up again next time
+        speed_logger.debug('AnkiConnect unreachable, %d kanji left without a definition', len(missing))
+        return
+
+    for kanji_info in missing:
+        meaning = offline_info.get(kanji_info['kanji'], dict()).get('meaning')
+        if meaning:
+            kanji_info['definition'] = meaning
+            okjiten_cache(kanji_info['kanji'], kanji_info, save_to_dict=True)
+            metrics.count('definition_source_ankiconnect')
+
+
+def is_complete_okjiten_info(cache: dict or None) -> bool:
+    """
+    checks that cache isn't empty and that all cache items have a value
+    if at least one key doesn't have a value (or len != 9), some info might be missing and it has to be scraped again
+    """
+    return cache is not None and all(cache.values()) and len(cache) == 9
 
-                indiv_kanji_info['kanji'] = kanji
 
-                definition_cache = ''
-                try: definition_cache = cache.get('definition') if cache else ''
-                except AttributeError: definition_cache = ''
-                if not definition_cache: definition_cache = kanjidic2_info(kanji)
-                if not definition_cache: definition_cache = tangorin_kanji_info(kanji)
-                if not definition_cache:
-                    definition_cache = offline_kanji_info(kanji) or ''
-                    if definition_cache: definition_cache = definition_cache.get('meaning', '')
-
-                indiv_kanji_info['definition']  = definition_cache or ''
-
-                # very important: add the site if it matched, this way, the next time this func runs
-                # we won't have to run through all 3 sites just to get to the kanji
-                indiv_kanji_info['scraped_from'] = site
-
-                speed_logger.info(f'--- (3) K: {kanji} after indiv_kanji_info[\'scraped_from\']'
-                                  f' : {round(time.time() - initial_time, 5)} ---')
-                # for some stupid reason, it can't match for kanji like 参, but will match its kyuujitai 參
-                # TODO, if exception, try searching for its kyuujitai counterpart, look for a website that does that
-                # or might be nvm because for some reason it werks now
+def okjiten_kanji_info(kanji: str, ankiconnect: bool = True) -> dict or None:
+    """
+    Scrapes (or gets from the cache) the okjiten info of a single kanji
+    see okjiten_etymology() for the keys of the returned dict
+    ankiconnect=False leaves the AnkiConnect definition fallback to the caller
+
+    A cached entry older than okjiten_fresh_days is still returned right away,
+    and revalidated against okjiten in the background (stale-while-revalidate)
 
-                found = None
-                try:
-                    href = cache.get('actual_page')
-                except AttributeError:
-                    found = soup.find('a', text=kanji)
-                    if found: href = found.get('href') # returns a str
-                if not href: continue
+    Returns:
+        kanji info dict, None if the kanji isn't on okjiten or its page couldn't be scraped
+    """
+    entry = okjiten_store.get_entry(kanji)
+    cache, fetched_at = entry if entry else (None, 0)
 
-                href = 'https://okjiten.jp/{}'.format(href)
-                indiv_kanji_info['actual_page'] = href
+    if is_complete_okjiten_info(cache):
+        metrics.count('okjiten_cache_hit')
+        fresh_days = config.get('okjiten_fresh_days')
+        if fresh_days and time.time() - fetched_at > fresh_days * 24 * 60 * 60:
+            revalidate_okjiten_kanji(kanji)
+        return cache
+    metrics.count('okjiten_cache_miss')
 
-                kanji_page = try_access_site(href)
-                if kanji_page: kanji_soup = BeautifulSoup(kanji_page, features='html.parser')
-                else: continue
+    return _scrape_okjiten_kanji(kanji, cache or None, ankiconnect=ankiconnect)
 
-                speed_logger.info(f'--- (4) K: {kanji} after kanji_page = try_access_site({href})'
-                                  f' : {round(time.time() - initial_time, 5)} ---')
-
-                tables = kanji_soup.find_all('td', attrs={'colspan': 12} )
-                if not tables: continue
 
-                ### ------------------------ START (1) ------------------------
-                ### (1) scrape the 成り立ち image table
+# the kanji being revalidated in the background, each one only once at a time
+_revalidating = set()
+_revalidating_lock = threading.Lock()
+_revalidation_executor = None
 
-                # https://github.com/rgamici/anki_plugin_jaja_definitions/blob/master/__init__.py#L86
-                # https://beautiful-soup-4.readthedocs.io/en/latest/
-                # tables will be reused in the other scrapers
-
-                # len(TABLES) == 3 ALWAYS!
-                for table in tables:
-                    kanji_soup = table.find('td', attrs={'height': 100} )
-                    if kanji_soup: break
-
-                etymology_image_src = kanji_soup.find('img')
-                try: etymology_image_src = etymology_image_src.get('src')
-                except AttributeError: etymology_image_src = ''
-
-                if etymology_image_src:
-                    etymology_image_url             = 'https://okjiten.jp/{}'.format(etymology_image_src)
-
-                    # use image_filename for downloading and storing the media
-                    # add _ before img filename before anki keeps deleting these GIFs
-                    # could be because I use them inside a JS script
-                    image_filename                  = '_okijiten-{}'.format(etymology_image_src)
-                    anki_image_src                  = '<img src = "{}">'.format(image_filename)
-
-                    indiv_kanji_info['image_filename']      = image_filename
-                    indiv_kanji_info['online_img_url']      = etymology_image_url
-                    indiv_kanji_info['anki_img_url']        = anki_image_src
-
-                speed_logger.info(f'--- (5) K: {kanji} after scrape the 成り立ち image table'
-                                  f' : {round(time.time() - initial_time, 5)} ---')
-                ### ------------------------ END (1) ------------------------
-                # TODO: scrape the image and put it inside the media folder, try to resize it if u can
-
-
-                ### ------------------------ START (2) ------------------------
-                ### (2) scrape the 成り立ち text table / usually https://okjiten.jp/{}#a
-                # do a findall and the etym text is always the 3rd table row from the top, etc., this is always the same
-                # the 3rd table - TABLES[2] always contains the main content
-
-                def_text = ''
-
-                etymology_text_cache = ''
-                try: etymology_text_cache = cache.get('etymology_text')
-                except AttributeError: etymology_text_cache = ''
-
-                if not etymology_text_cache:
-                    main_body = tables[2]
-                    th = main_body.find('th', attrs={'align': 'left'})
-
-                    if th:
-                        th          = BeautifulSoup(str(th), features='html.parser')
-                        etymology   = th.get_text().strip()
-                        etymology   = ''.join(etymology.split())
-                        etymology   = etymology.replace('※', '<br>') # for anki
-
-                        def_text    += etymology
-
-                    else:
-                        # there are cases where len(th)==0, usually it uses a td instead of a th
-                        # sample: https://okjiten.jp/kanji1408.html(脅)
-                        # in such cases, just go through every tr, and find what is relevant
-
-                        # http://nihongo.monash.edu/kanjitypes.html (6 kanji types) (only 4 are on the site)
-                        kanji_class = [
-                            '象形文字',  # pictographs/hieroglyphs
-                            '指事文字',  # "logograms", "simple ideographs", representation of abstract ideas
-                            '会意文字',  # compound ideograph e.g. 休 (rest) from 人 (person) and 木 (tree
-                            '会意兼形声文字',  # compound ideo + phono-semantic at the same time
-                            '形声文字',  # semasio-phonetic"
-                            '国字' ]  # check last, not usually found at the start of the sentence, but inside
-
-
-                        tr = main_body.find_all('tr')
-                        # tr[7] is usually the .gif for the etymology image, tr[8] is etymology text
-
-                        if tr:
-                            etymology = tr[8]
-
-                            etymology = BeautifulSoup(str(etymology), features='html.parser')
-                            etymology = etymology.get_text().strip()
-
-                            if etymology and any(class_ in etymology for class_ in kanji_class):
-                                etymology   = ''.join(etymology.split())
-                                etymology   = etymology.replace('※', '<br>')  # for anki
-                                def_text    += etymology
-
-                indiv_kanji_info['etymology_text']  = def_text or etymology_text_cache
-                indiv_kanji_info['src']             = 'okijiten'
-
-                speed_logger.info(f'--- (6) after scrape the 成り立ち TEXT table'
-                                  f' : {round(time.time() - initial_time, 5)} ---')
-                ### ------------------------ END (2) ------------------------
-
-                # TODO
-                ### (3) scrape the 読み table / usually https://okjiten.jp/{}#b
-                # TODO
-                ### (4) scrape the 部首 table / usually https://okjiten.jp/{}#c
-
-                result_list.append(indiv_kanji_info)
-
-                log_bool2 = log_bool3 = False
-                if cache is None:
-                    okjiten_cache(kanji=kanji,
-                                  kanji_info_to_save=indiv_kanji_info,
-                                  save_to_dict=True)
-                elif cache and len(cache) != len(indiv_kanji_info):
-                    log_bool2 = True
-                    okjiten_cache(kanji=kanji,
-                                  kanji_info_to_save=indiv_kanji_info,
-                                  save_to_dict=True)
-                elif cache and any(cache[key] != indiv_kanji_info[key]
-                                   for key, value in cache.items()):
-                    log_bool3 = True
-                    okjiten_cache(kanji=kanji,
-                                  kanji_info_to_save=indiv_kanji_info,
-                                  save_to_dict=True)
-
-                speed_logger.info(f'--- (7) END: after adding to cache if needed'
-                                  f'-- cache exists? : {bool(cache)} --'
-                                  f' len(cache) != len(indiv_kanji_info)? : {log_bool2} --'
-                                  f' any(cache[key] != indiv_kanji_info[key]?: {log_bool3} --'
-                                  f' : {round(time.time() - initial_time, 5)} ---')
-
-                # break out for site for sites loop -> if kanji in str(soup) and soup:
-                # because if the kanji is inside the site, no need to go over the other sites
-                # as such this for loop only runs one if the kanji is within the site at first try
-                break
 
-    # print(result_dict['online_img_url'])
-    return result_list
+def revalidate_okjiten_kanji(kanji: str):
+    """
+    Scrapes the kanji again on a background thread, the new info (or just a new timestamp if nothing changed)
+    is committed to the okjiten cache as soon as it's done, the other pending entries are left to commit_caches()
+    """
+    global _revalidation_executor
+    if config.get('offline_only'):
+        return
+
+    with _revalidating_lock:
+        if kanji in _revalidating:
+            return
+        _revalidating.add(kanji)
+        if _revalidation_executor is None:
+            _revalidation_executor = ThreadPoolExecutor(max_workers=1)
+    metrics.count('okjiten_stale_served')
+
+    def revalidate():
+        try:
+            # None: okjiten couldn't be reached, the entry stays stale and is revalidated again next time
+            if _scrape_okjiten_kanji(kanji, okjiten_cache(kanji, save_to_dict=False), revalidate=True):
+                okjiten_store.commit(keys=[kanji])
+        except Exception:
+            # the stale entry stays, it's revalidated again the next time it's served
+            speed_logger.exception('revalidation of %s failed', kanji)
+        finally:
+            with _revalidating_lock:
+                _revalidating.discard(kanji)
+
+    _revalidation_executor.submit(revalidate)
+
+
+def _scrape_okjiten_kanji(kanji: str, cache: dict or None, revalidate=False, ankiconnect=True) -> dict or None:
+    """
+    Args:
+        cache:          the current (incomplete or stale) cache entry, its definition is kept
+        revalidate:     asks okjiten again even if the page is in the response cache, and keeps the
+                        etymology text of the page instead of the cached one
+        ankiconnect:    False skips the AnkiConnect definition source
+    """
+    indiv_kanji_info = dict()
+
+    index_entry = okjiten_index().get(kanji)
+    # the kanji isn't listed on any of the okjiten index pages, nothing to scrape
+    if not index_entry: return None
+    site, href = index_entry
+
+    indiv_kanji_info['kanji'] = kanji
+
+    definition_cache = ''
+    try: definition_cache = cache.get('definition') if cache else ''
+    except AttributeError: definition_cache = ''
+    if not definition_cache:
+        with metrics.stage('definition_chain'):
+            definition_cache, source = resolve_definition(kanji, exclude=() if ankiconnect else ('ankiconnect',))
+        speed_logger.debug('definition of %s from %s', kanji, source)
+
+    indiv_kanji_info['definition']  = definition_cache or ''
+
+    # keep track of which index page the kanji was listed on
+    indiv_kanji_info['scraped_from'] = site
+
+    href = 'https://okjiten.jp/{}'.format(href)
+    indiv_kanji_info['actual_page'] = href
+
+    with metrics.stage('kanji_page_fetch'):
+        kanji_page = try_access_site(href, revalidate=revalidate)
+    if not kanji_page: return None
+
+    # only the td[colspan=12] content tables are parsed, see parsers.py
+    with metrics.stage('parse'):
+        kanji_page_info = parse_okjiten_kanji_page(kanji_page)
+    if not kanji_page_info: return None
+
+    ### ------------------------ START (1) ------------------------
+    ### (1) the 成り立ち image table
+
+    etymology_image_src = kanji_page_info['etymology_image_src']
+
+    if etymology_image_src:
+        etymology_image_url             = 'https://okjiten.jp/{}'.format(etymology_image_src)
+
+        # use image_filename for downloading and storing the media
+        # add _ before img filename before anki keeps deleting these GIFs
+        # could be because I use them inside a JS script
+        image_filename                  = '_okijiten-{}'.format(etymology_image_src)
+        anki_image_src                  = '<img src = "{}">'.format(image_filename)
+
+        indiv_kanji_info['image_filename']      = image_filename
+        indiv_kanji_info['online_img_url']      = etymology_image_url
+        indiv_kanji_info['anki_img_url']        = anki_image_src
+    ### ------------------------ END (1) ------------------------
+
+
+    ### ------------------------ START (2) ------------------------
+    ### (2) the 成り立ち text table / usually https://okjiten.jp/{}#a
+
+    etymology_text_cache = ''
+    try: etymology_text_cache = cache.get('etymology_text') if not revalidate else ''
+    except AttributeError: etymology_text_cache = ''
+
+    indiv_kanji_info['etymology_text']  = etymology_text_cache or kanji_page_info['etymology_text']
+    indiv_kanji_info['src']             = 'okijiten'
+    ### ------------------------ END (2) ------------------------
+
+    # TODO
+    ### (3) scrape the 読み table / usually https://okjiten.jp/{}#b
+    # TODO
+    ### (4) scrape the 部首 table / usually https://okjiten.jp/{}#c
+
+    # only save if something changed, a revalidated entry is always saved to renew its timestamp
+    if cache is None or revalidate \
+            or len(cache) != len(indiv_kanji_info) \
+            or any(cache.get(key) != value for key, value in indiv_kanji_info.items()):
+        with metrics.stage('cache_write'):
+            okjiten_cache(kanji=kanji,
+                          kanji_info_to_save=indiv_kanji_info,
+                          save_to_dict=True)
+
+    return indiv_kanji_info
 
 if __name__ == '__main__':
     sample_vocab = '参夢紋脅' #統參参夢紋泥恢疎姿勢'  # 自得だと思わないか' #！夢この前、あの姿勢のまま寝てるの見ましたよ固執流河麻薬所持容疑'
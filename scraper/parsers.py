@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+# Copyright: Tanaka Aiko (https://github.com/aiko-tanaka)
+# License: GNU AGPL, version 3 or later; https://www.gnu.org/licenses/agpl-3.0.en.html
+
+"""
+HTML parsers for the okjiten, tangorin and dong-chinese pages
+
+Only the few nodes that are actually used are parsed (through a SoupStrainer) instead of
+building the whole page tree, and lxml is used instead of html.parser when it's installed
+dong-chinese pages aren't parsed at all, the embedded JSON is pulled straight out of the response bytes
+
+This module only depends on bs4, so that benchmarks/bench_parsers.py can import it outside of Anki
+"""
+
+from bs4 import BeautifulSoup, SoupStrainer
+
+import importlib.util
+import json
+import re
+
+PARSER_BACKEND = 'lxml' if importlib.util.find_spec('lxml') else 'html.parser'
+
+
+# http://nihongo.monash.edu/kanjitypes.html (6 kanji types) (only 4 are on the site)
+KANJI_CLASS = [
+    '象形文字',  # pictographs/hieroglyphs
+    '指事文字',  # "logograms", "simple ideographs", representation of abstract ideas
+    '会意文字',  # compound ideograph e.g. 休 (rest) from 人 (person) and 木 (tree
+    '会意兼形声文字',  # compound ideo + phono-semantic at the same time
+    '形声文字',  # semasio-phonetic"
+    '国字' ]  # check last, not usually found at the start of the sentence, but inside
+
+# okjiten kanji pages: the content tables, len(TABLES) == 3 ALWAYS!
+OKJITEN_TABLES      = SoupStrainer('td', attrs={'colspan': '12'})
+# okjiten index pages: links to the kanji pages
+OKJITEN_LINKS       = SoupStrainer('a', href=True)
+# tangorin kanji search: english definitions
+TANGORIN_MEANINGS   = SoupStrainer('p', attrs={'class': 'k-meanings'})
+
+# dong-chinese: window["__sink__charData_..."]={...};</script>
+DONG_CHAR_DATA      = re.compile(rb'window\["[^"]*__sink__charData_[^"]*"\]=(.*?);</script>', re.DOTALL)
+# <div class="MuiGrid-root MuiGrid-item MuiGrid-grid-xs-12" style="padding:8px">...<span><span><span>definition</span></span><a href=
+DONG_DEFINITION_DIV = b'<div class="MuiGrid-root MuiGrid-item MuiGrid-grid-xs-12" style="padding:8px">'
+DONG_DEFINITION     = re.compile(rb'<span><span><span>(.*?)</span></span><a href=', re.DOTALL)
+
+
+def parse_okjiten_index(html, backend: str = None) -> list:
+    """
+    Returns:
+        [(kanji, href), ...] of every link on the index page whose text is a single character
+    """
+    soup = BeautifulSoup(html, features=backend or PARSER_BACKEND, parse_only=OKJITEN_LINKS)
+
+    links = []
+    for anchor in soup.find_all('a', href=True):
+        text = anchor.get_text().strip()
+        if len(text) == 1:
+            links.append((text, anchor.get('href')))
+
+    return links
+
+
+def parse_okjiten_kanji_page(html, backend: str = None) -> dict or None:
+    """
+    Returns:
+        {'etymology_image_src': relative src of the 成り立ち image or '',
+         'etymology_text': 成り立ち text or ''}
+        None if the page doesn't have the okjiten content tables
+    """
+    soup = BeautifulSoup(html, features=backend or PARSER_BACKEND, parse_only=OKJITEN_TABLES)
+
+    tables = soup.find_all('td', attrs={'colspan': '12'})
+    if not tables:
+        return None
+
+    ### (1) the 成り立ち image table
+    # https://github.com/rgamici/anki_plugin_jaja_definitions/blob/master/__init__.py#L86
+    etymology_image_src = ''
+    for table in tables:
+        image_td = table.find('td', attrs={'height': '100'})
+        if image_td:
+            image = image_td.find('img')
+            if image: etymology_image_src = image.get('src') or ''
+            break
+
+    ### (2) the 成り立ち text table / usually https://okjiten.jp/{}#a
+    # the etym text is always the 3rd table row from the top, TABLES[2] always contains the main content
+    etymology_text = ''
+    if len(tables) > 2:
+        main_body = tables[2]
+        th = main_body.find('th', attrs={'align': 'left'})
+
+        if th:
+            etymology       = th.get_text().strip()
+            etymology_text  = ''.join(etymology.split())
+
+        else:
+            # there are cases where len(th)==0, usually it uses a td instead of a th
+            # sample: https://okjiten.jp/kanji1408.html(脅)
+            # tr[7] is usually the .gif for the etymology image, tr[8] is etymology text
+            tr = main_body.find_all('tr')
+            if len(tr) > 8:
+                etymology = tr[8].get_text().strip()
+                if etymology and any(class_ in etymology for class_ in KANJI_CLASS):
+                    etymology_text = ''.join(etymology.split())
+
+    return {
+        'etymology_image_src':  etymology_image_src,
+        # ※ marks a new line, <br> for anki
+        'etymology_text':       etymology_text.replace('※', '<br>'),
+    }
+
+
+def parse_tangorin_meanings(html, backend: str = None) -> str:
+    """
+    Returns:
+        the text of the k-meanings paragraph, '' if there isn't one
+    """
+    soup = BeautifulSoup(html, features=backend or PARSER_BACKEND, parse_only=TANGORIN_MEANINGS)
+
+    en_definitions = soup.find('p', attrs={'class': 'k-meanings'})
+    return en_definitions.get_text().strip() if en_definitions else ''
+
+
+def parse_dong_page(html: bytes) -> dict or None:
+    """
+    Pulls the embedded charData JSON (and the definition) straight out of the page, without building a DOM
+    Returns:
+        {'found': False} if dong-chinese doesn't know the character
+        {'found': True, 'hint': ..., 'definition': ..., 'components': [...]} otherwise
+        None if the page doesn't contain any charData (e.g. a broken response)
+    """
+    matches = DONG_CHAR_DATA.findall(html)
+    if not matches:
+        return None
+
+    # the last charData block is the one of the character itself
+    char_data_text = matches[-1]
+    if b'"error":"Word not found"' in char_data_text:
+        return {'found': False}
+
+    try:
+        char_data: dict = json.loads(char_data_text)
+    except ValueError:
+        return None
+
+    definition = ''
+    div_start = html.find(DONG_DEFINITION_DIV)
+    if div_start != -1:
+        found = DONG_DEFINITION.search(html, div_start)
+        if found: definition = found.group(1).decode('utf8', errors='replace')
+
+    # get only one keyword from the many keywords separated by ; and or ,
+    if ';' in definition:
+        definition = definition.split('; ')[0]
+    if ',' in definition:
+        definition = definition.split(', ')[0]
+
+    return {
+        'found':        True,
+        'hint':         char_data.get('hint') or '',
+        'definition':   definition,
+        'components':   char_data.get('components') or [],
+    }
@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+# Copyright: Tanaka Aiko (https://github.com/aiko-tanaka)
+# License: GNU AGPL, version 3 or later; https://www.gnu.org/licenses/agpl-3.0.en.html
+
+"""
+Fills the kanji cache with every kanji of the okjiten index lists (jōyō, jinmeiyō and kanken pre-1/1),
+without Anki, so that the Regen runs inside Anki are served from the cache
+
+For each kanji: the okjiten etymology (and its definition, kanjidic2 first), the etymology image
+and the furigana of the etymology text. Run it from the folder containing the add-on:
+    python -m scraper.prewarm --media-folder "C:\\...\\Anki2\\User 1\\collection.media" --rate 2
+
+The config is read from the add-on's config.json. It can be stopped (Ctrl+C) at any time,
+everything is committed every --commit-every kanji, and kanji already in the cache are skipped
+on the next run without going online
+"""
+
+from .config import config
+from .online_dictionaries import OKJITEN_INDEX_PAGES, okjiten_index, okjiten_kanji_info, okjiten_cache, \
+    is_complete_okjiten_info
+from .offline_dictionaries import load_kanjidic2
+from .kanji_mecab import cached_furigana
+from .kanji_cache import commit_caches, close_caches
+from .utils import image_downloader
+from .metrics import metrics
+from .http_client import http_client
+
+from concurrent.futures import ThreadPoolExecutor
+
+import argparse
+import threading
+import time
+import sys
+
+
+# --lists name -> okjiten index page
+INDEX_LISTS = dict(zip(['joyo', 'kanken', 'jinmeiyo'], OKJITEN_INDEX_PAGES))
+
+
+class RateLimiter:
+    """
+    At most `rate` kanji started per second, shared by every worker thread (0 = no limit)
+    """
+    def __init__(self, rate: float):
+        self.interval   = 1 / rate if rate else 0
+        self._next      = 0.0
+        self._lock      = threading.Lock()
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next)
+            self._next = start + self.interval
+        time.sleep(max(0.0, start - now))
+
+
+def prewarm(kanji_list: list,
+            workers: int,
+            rate: float,
+            commit_every: int,
+            download_images: bool = True,
+            furigana: bool = True) -> dict:
+    """
+    Returns:
+        {'cached': already complete in the cache, 'scraped': ..., 'failed': ...}
+    """
+    counts = {'cached': 0, 'scraped': 0, 'failed': 0}
+    rate_limiter = RateLimiter(rate)
+    texts = []
+
+    def warm(kanji):
+        cached = okjiten_cache(kanji, save_to_dict=False)
+        if is_complete_okjiten_info(cached):
+            return 'cached', cached
+
+        rate_limiter.wait()
+        kanji_info = okjiten_kanji_info(kanji)
+        return ('scraped', kanji_info) if kanji_info else ('failed', None)
+
+    executor = ThreadPoolExecutor(max_workers=workers)
+    try:
+        for done, (status, kanji_info) in enumerate(executor.map(warm, kanji_list), start=1):
+            counts[status] += 1
+            if kanji_info:
+                texts.append(kanji_info.get('etymology_text'))
+                if download_images and kanji_info.get('online_img_url') and kanji_info.get('image_filename'):
+                    image_downloader.submit(kanji_info['online_img_url'], kanji_info['image_filename'],
+                                            use_inside_anki=False)
+
+            if done % commit_every == 0 or done == len(kanji_list):
+                if furigana and texts:
+                    cached_furigana(texts)
+                    texts = []
+                commit_caches()
+                print('{}/{} kanji | {}'.format(done, len(kanji_list), counts), flush=True)
+
+    except KeyboardInterrupt:
+        print('stopping, the kanji done so far are kept', flush=True)
+        executor.shutdown(wait=False, cancel_futures=True)
+        raise
+
+    finally:
+        executor.shutdown(wait=True)
+        image_downloader.wait()
+        commit_caches()
+
+    return counts
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument('--lists', nargs='+', choices=list(INDEX_LISTS.keys()), default=list(INDEX_LISTS.keys()),
+                            help='okjiten index lists to crawl')
+    arg_parser.add_argument('--workers', type=int, default=config.get('scraper_workers'),
+                            help='kanji scraped at the same time')
+    arg_parser.add_argument('--rate', type=float, default=1.0,
+                            help='kanji pages fetched per second at most, 0 for no limit')
+    arg_parser.add_argument('--commit-every', type=int, default=50,
+                            help='kanji between two commits of the cache')
+    arg_parser.add_argument('--media-folder', default=config.get('media_debug_folder'),
+                            help='folder the etymology images are saved in, usually the collection.media of the profile')
+    arg_parser.add_argument('--kanji-cache-path', default=config.get('kanji_cache_path'))
+    arg_parser.add_argument('--mecab-path', help='folder containing mecab_controller (AJT Japanese add-on)')
+    arg_parser.add_argument('--no-images', action='store_true')
+    arg_parser.add_argument('--refresh-index', action='store_true', help='download the okjiten index lists again')
+    args = arg_parser.parse_args()
+
+    config['kanji_cache_path']      = args.kanji_cache_path
+    config['media_debug_folder']    = args.media_folder
+    if args.mecab_path:
+        sys.path.append(args.mecab_path)
+
+    furigana = True
+    try:
+        __import__('mecab_controller')
+    except ImportError:
+        print('mecab_controller not found (see --mecab-path), furigana is skipped', flush=True)
+        furigana = False
+
+    load_kanjidic2()
+
+    wanted_lists = {INDEX_LISTS[name] for name in args.lists}
+    kanji_list = [kanji for kanji, (site, href) in okjiten_index(refresh=args.refresh_index).items()
+                  if site in wanted_lists]
+    print('{} kanji in {}'.format(len(kanji_list), ', '.join(args.lists)), flush=True)
+
+    try:
+        counts = prewarm(kanji_list,
+                         workers=max(1, args.workers),
+                         rate=args.rate,
+                         commit_every=max(1, args.commit_every),
+                         download_images=not args.no_images,
+                         furigana=furigana)
+    finally:
+        close_caches()
+        if metrics.enabled:
+            print(metrics.summary())
+        skipped_hosts = http_client.skipped_hosts()
+        if skipped_hosts:
+            print('skipped hosts (unreachable): {}'.format(skipped_hosts))
+
+    print('done | {}'.format(counts))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+# Copyright: Tanaka Aiko (https://github.com/aiko-tanaka)
+# License: GNU AGPL, version 3 or later; https://www.gnu.org/licenses/agpl-3.0.en.html
+
+"""
+Checkpoint journal of a Regen run, so that a crashed or cancelled run can be resumed
+
+There is one journal per note selection (named after a hash of the sorted note ids) inside
+kanji_cache_path/regen_journal_folder. Every line is a committed chunk:
+    {"notes": [note ids written to the collection], "kanji": [kanji resolved and saved in the kanji cache]}
+
+Running Regen again on the same selection skips the journaled notes,
+the journal is deleted once every note of the selection is done
+"""
+
+from .config import config
+
+import hashlib
+import json
+import os
+
+
+class RegenJournal:
+    """
+    Attributes
+    ----------
+    path : str
+        journal file of this note selection
+    completed_notes : set
+        note ids already written by a previous (interrupted) run or by this one
+    resolved_kanji : set
+        kanji whose etymology is already saved in the kanji cache
+    """
+    def __init__(self, fids: list):
+        selection = ','.join(str(fid) for fid in sorted(fids))
+        digest = hashlib.sha1(selection.encode('utf8')).hexdigest()
+
+        folder = os.path.join(config.get('kanji_cache_path'), config.get('regen_journal_folder'))
+        os.makedirs(folder, exist_ok=True)
+        self.path = os.path.join(folder, digest + '.jsonl')
+
+        self.completed_notes = set()
+        self.resolved_kanji  = set()
+        self._load()
+
+
+    def _load(self):
+        if not os.path.isfile(self.path):
+            return
+
+        with open(self.path, 'r', encoding='utf8') as fh:
+            for line in fh:
+                try:
+                    entry: dict = json.loads(line)
+                except ValueError:
+                    # the last line can be cut in half by a crash, that chunk is simply redone
+                    continue
+                self.completed_notes.update(entry.get('notes', []))
+                self.resolved_kanji.update(entry.get('kanji', []))
+
+
+    def record(self, note_ids: list, kanji: list):
+        """
+        Call only after the notes are written and the kanji cache is committed
+        """
+        self.completed_notes.update(note_ids)
+        self.resolved_kanji.update(kanji)
+
+        with open(self.path, 'a', encoding='utf8') as fh:
+            fh.write(json.dumps({'notes': list(note_ids), 'kanji': list(kanji)}, ensure_ascii=False) + '\n')
+            fh.flush()
+            os.fsync(fh.fileno())
+
+
+    def finish(self):
+        """
+        The whole selection is done, nothing to resume
+        """
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
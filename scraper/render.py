@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+# Copyright: Tanaka Aiko (https://github.com/aiko-tanaka)
+# License: GNU AGPL, version 3 or later; https://www.gnu.org/licenses/agpl-3.0.en.html
+
+"""
+Rendering of the kanji_etym_field
+
+Every kanji is rendered once into a segment:
+    kanji(definition) | anki_img_url | etymology text with furigana
+and the field of a note is a join of the segments of its kanji, okjiten ones first, then the kanjidic2 ones
+
+Segments are memoized per kanji along with the values they were built from,
+a segment is built again as soon as one of those values changes (e.g. okjiten updated the etymology)
+"""
+
+from .metrics import metrics
+
+
+# use <pseudo-newline> for JS-splitting inside anki because I already use <br> inside
+# etymology_text  = etym_info['etymology_text'] to replace the character '※'
+SEGMENT_SEPARATOR = '<pseudo-newline>'
+
+# kanji -> (values the segment was built from, segment)
+_segments = dict()
+
+
+def kanji_segment(kanji: str, definition, anki_img_url='', etymology='') -> str:
+    """
+    kanjidic2-only kanji don't have an image nor an etymology, their segment is 'kanji(definition) |  | '
+    """
+    source = (definition, anki_img_url, etymology)
+
+    memo = _segments.get(kanji)
+    if memo is not None and memo[0] == source:
+        metrics.count('segment_cache_hit')
+        return memo[1]
+    metrics.count('segment_cache_miss')
+
+    segment = '{}({}) | {} | {}'.format(kanji, definition, anki_img_url, etymology).replace(r'\n', '')
+    _segments[kanji] = (source, segment)
+    return segment
+
+
+def render_field(kanji_only: list, okjiten_segments: dict, kd2_segments: dict) -> str or None:
+    """
+    Returns:
+        the kanji_etym_field content, None if none of the kanji has a segment
+    """
+    field = SEGMENT_SEPARATOR.join([okjiten_segments[kanji] for kanji in kanji_only if kanji in okjiten_segments] +
+                                   [kd2_segments[kanji] for kanji in kanji_only if kanji in kd2_segments])
+    return field.strip() or None
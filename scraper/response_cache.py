@@ -0,0 +1,211 @@
+# -*- coding: utf-8 -*-
+# Copyright: Tanaka Aiko (https://github.com/aiko-tanaka)
+# License: GNU AGPL, version 3 or later; https://www.gnu.org/licenses/agpl-3.0.en.html
+
+"""
+On-disk cache of the raw HTML responses of okjiten, tangorin and dong-chinese
+
+Bodies are stored content-addressed (by their sha256) inside response_cache_folder,
+the url -> body index lives in the kanji cache sqlite file
+
+- every source (host) has its own TTL, see response_cache_ttl_days
+- least recently used responses are evicted once the bodies go over response_cache_max_mb
+- with offline_only set, try_access_site only serves from this cache and never goes to the network,
+  which makes re-running the parsers on the same pages free and reproducible
+"""
+
+from .kanji_cache import open_cache_db, register_cache
+from .config import config
+
+import urllib.parse
+import threading
+import hashlib
+import time
+import os
+
+
+class ResponseCache:
+    def __init__(self):
+        self._conn          = None
+        self._total_size    = 0
+        # url -> last access time, only written to the index on commit()
+        self._accessed      = dict()
+        self._lock          = threading.RLock()
+        register_cache(self)
+
+
+    @property
+    def folder(self) -> str:
+        return os.path.join(config.get('kanji_cache_path'), config.get('response_cache_folder'))
+
+
+    def _connect(self):
+        if self._conn is None:
+            self._conn = open_cache_db()
+            with self._conn:
+                self._conn.execute('CREATE TABLE IF NOT EXISTS responses ('
+                                   'url TEXT PRIMARY KEY, '
+                                   'digest TEXT NOT NULL, '
+                                   'size INTEGER NOT NULL, '
+                                   'fetched_at REAL NOT NULL, '
+                                   'last_access REAL NOT NULL, '
+                                   'etag TEXT, '
+                                   'last_modified TEXT)')
+                self._conn.execute('CREATE INDEX IF NOT EXISTS responses_last_access ON responses (last_access)')
+
+            # identical bodies are only stored once, count each of them once
+            row = self._conn.execute('SELECT SUM(size) FROM '
+                                     '(SELECT DISTINCT digest, size FROM responses)').fetchone()
+            self._total_size = row[0] or 0
+
+        return self._conn
+
+
+    def _body_path(self, digest: str) -> str:
+        return os.path.join(self.folder, digest[:2], digest)
+
+
+    @staticmethod
+    def ttl(url: str) -> float:
+        """
+        TTL (seconds) of the source (host) of the url, falls back to the 'default' TTL
+        """
+        ttl_days: dict = config.get('response_cache_ttl_days')
+        host = urllib.parse.urlsplit(url).netloc
+
+        for source, days in ttl_days.items():
+            if source != 'default' and source in host:
+                return days * 24 * 60 * 60
+
+        return ttl_days.get('default', 0) * 24 * 60 * 60
+
+
+    def lookup(self, url: str) -> dict or None:
+        """
+        Returns:
+            {'body': bytes, 'fresh': bool, 'etag': ..., 'last_modified': ...} or None if the url isn't cached
+        """
+        with self._lock:
+            row = self._connect().execute('SELECT digest, fetched_at, etag, last_modified '
+                                          'FROM responses WHERE url = ?', (url,)).fetchone()
+            if row is None:
+                return None
+
+            digest, fetched_at, etag, last_modified = row
+            try:
+                with open(self._body_path(digest), 'rb') as fh:
+                    body = fh.read()
+            except OSError:
+                # the body was deleted from under us, forget about it
+                with self._conn:
+                    self._conn.execute('DELETE FROM responses WHERE url = ?', (url,))
+                return None
+
+            self._accessed[url] = time.time()
+
+        return {
+            'body':             body,
+            'fresh':            time.time() - fetched_at < self.ttl(url),
+            'etag':             etag,
+            'last_modified':    last_modified,
+        }
+
+
+    def store(self, url: str, body: bytes, etag: str = None, last_modified: str = None):
+        digest = hashlib.sha256(body).hexdigest()
+        body_path = self._body_path(digest)
+        now = time.time()
+
+        with self._lock:
+            conn = self._connect()
+
+            if not os.path.isfile(body_path):
+                os.makedirs(os.path.dirname(body_path), exist_ok=True)
+                temp_path = '{}.{}.part'.format(body_path, threading.get_ident())
+                with open(temp_path, 'wb') as fh:
+                    fh.write(body)
+                os.replace(temp_path, body_path)
+                self._total_size += len(body)
+
+            old = conn.execute('SELECT digest FROM responses WHERE url = ?', (url,)).fetchone()
+            with conn:
+                conn.execute('INSERT OR REPLACE INTO responses '
+                             '(url, digest, size, fetched_at, last_access, etag, last_modified) '
+                             'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                             (url, digest, len(body), now, now, etag, last_modified))
+            if old and old[0] != digest:
+                self._remove_body_if_unused(old[0])
+
+            self._evict()
+
+
+    def revalidated(self, url: str):
+        """
+        The site answered 304, the cached body is fresh again
+        """
+        with self._lock:
+            now = time.time()
+            with self._connect():
+                self._conn.execute('UPDATE responses SET fetched_at = ?, last_access = ? WHERE url = ?',
+                                   (now, now, url))
+
+
+    def _remove_body_if_unused(self, digest: str):
+        conn = self._connect()
+        if conn.execute('SELECT 1 FROM responses WHERE digest = ? LIMIT 1', (digest,)).fetchone():
+            return
+
+        body_path = self._body_path(digest)
+        try:
+            self._total_size -= os.path.getsize(body_path)
+            os.remove(body_path)
+        except OSError:
+            pass
+
+
+    def _evict(self):
+        """
+        Drops the least recently used responses until the bodies fit inside response_cache_max_mb
+        """
+        max_size = config.get('response_cache_max_mb') * 1024 * 1024
+        if self._total_size <= max_size:
+            return
+
+        # the in-memory access times have to be taken into account, otherwise hot pages would get evicted
+        self.commit()
+
+        conn = self._connect()
+        rows = conn.execute('SELECT url, digest FROM responses ORDER BY last_access').fetchall()
+        for url, digest in rows:
+            if self._total_size <= max_size:
+                break
+            with conn:
+                conn.execute('DELETE FROM responses WHERE url = ?', (url,))
+            self._remove_body_if_unused(digest)
+
+
+    def commit(self):
+        """
+        Writes the access times of the responses served since the last commit
+        """
+        with self._lock:
+            if not self._accessed:
+                return
+
+            conn = self._connect()
+            with conn:
+                conn.executemany('UPDATE responses SET last_access = ? WHERE url = ?',
+                                 [(accessed, url) for url, accessed in self._accessed.items()])
+            self._accessed.clear()
+
+
+    def close(self):
+        with self._lock:
+            self.commit()
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+                self._total_size = 0
+
+
+response_cache = ResponseCache()
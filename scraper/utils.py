@@ -2,17 +2,20 @@
 # Copyright: Tanaka Aiko (https://github.com/aiko-tanaka)
 # License: GNU AGPL, version 3 or later; https://www.gnu.org/licenses/agpl-3.0.en.html
 
-from .config import config
+from .config import config, main_window
+from .http_client import http_client
+from .metrics import metrics
 
+from concurrent.futures import ThreadPoolExecutor, Future
 from functools import wraps
 
 from collections import OrderedDict
 from bs4 import BeautifulSoup
 
-import urllib.request
-import urllib.parse
 import requests
+import requests.adapters
 
+import threading
 import logging
 import random
 import time
@@ -20,8 +23,6 @@ import sys
 import re
 import os
 
-from aqt import mw
-
 
 FORMAT = logging.Formatter('%(levelname)s \t| %(asctime)s: \t%(message)s',
                            '%Y-%m-%d %I:%M:%S %p')
@@ -50,20 +51,15 @@ def setup_logger(name, log_file, _format=FORMAT, level=logging.DEBUG):
 
     return logger
 
-# TODO: (important) you might want to use requests instead of urllib.request for try_access_site
-# so that download_image can use try_access_site instead of using its own try_acces
-
 # TODO: not yet usable, you should still create a config.py and config.md that pulls things like log path,
 # and other config settings
 ADD_ON_PATH = os.path.dirname(__file__)
 # # TODO: dynamically determine the name of the addon instead of r'\push_existing'
-LOG_FOLDER_PATH = ADD_ON_PATH + r'\logging'
-
-if not os.path.exists(LOG_FOLDER_PATH):
-    os.makedirs(LOG_FOLDER_PATH)
-
 NEW_PATH = os.path.join(ADD_ON_PATH, 'logging')
 
+if not os.path.exists(NEW_PATH):
+    os.makedirs(NEW_PATH)
+
 LOG_FILE_PATH = os.path.join(NEW_PATH, 'kanji_etym.log')
 # CALL_LOG_PATH = os.path.join(NEW_PATH, 'debug_call_log.log')
 
@@ -72,40 +68,105 @@ LOG_FILE_PATH = os.path.join(NEW_PATH, 'kanji_etym.log')
 speed_logger = setup_logger('speed_logger', LOG_FILE_PATH)
 
 
+class _CallRecord:
+    """
+    One calculate_time log line, only formatted (str() of the args, kwargs and result)
+    if the speed_logger actually emits it
+    """
+    __slots__ = ('name', 'elapsed', 'args', 'kwargs', 'result')
+
+    def __init__(self, name, elapsed, args=None, kwargs=None, result=None):
+        self.name       = name
+        self.elapsed    = elapsed
+        self.args       = args
+        self.kwargs     = kwargs
+        self.result     = result
+
+    def __str__(self):
+        if self.args is None:
+            return 'function "{}" took {} seconds'.format(self.name, self.elapsed)
+
+        result_for_log = ''
+        if self.result:
+            if isinstance(self.result, (str, list, dict)):
+                result_for_log = str(self.result)[:200]
+
+        return ('function "{}" took {} seconds '
+                '\t| args: {} '
+                '\t| kwargs: {} '
+                '\t| result: {}'
+                .format(self.name, self.elapsed, str(self.args), str(self.kwargs), result_for_log))
+
+
+# function name -> [calls, total seconds], filled in every profiling_mode except 'off'
+_call_stats = dict()
+_call_stats_lock = threading.Lock()
+
+
+def _profile_call(f, args, kwargs, with_call_info: bool):
+    """
+    Runs f according to the profiling_mode config:
+        'full'          every call is logged
+        'sampled'       every call is counted, only every profiling_sample_every-th call is logged
+        'aggregate'     calls are only counted, see call_stats_summary()
+        'off'           f is called as is
+    """
+    mode = config.get('profiling_mode')
+    if mode == 'off':
+        return f(*args, **kwargs)
+
+    before = time.perf_counter()
+    result = f(*args, **kwargs)
+    elapsed = time.perf_counter() - before
+
+    with _call_stats_lock:
+        stats = _call_stats.get(f.__name__)
+        if stats is None:
+            stats = _call_stats[f.__name__] = [0, 0.0]
+        stats[0] += 1
+        stats[1] += elapsed
+        calls = stats[0]
+
+    if mode == 'aggregate':
+        return result
+    if mode == 'sampled' and calls % config.get('profiling_sample_every'):
+        return result
+
+    if with_call_info:
+        speed_logger.info('%s', _CallRecord(f.__name__, elapsed, args, kwargs, result))
+    else:
+        speed_logger.info('%s', _CallRecord(f.__name__, elapsed))
+    return result
+
+
+def call_stats_summary(reset=True) -> str:
+    """
+    calls and total/mean time of every decorated function, slowest (total) first
+    """
+    with _call_stats_lock:
+        stats = sorted(_call_stats.items(), key=lambda item: item[1][1], reverse=True)
+        if reset:
+            _call_stats.clear()
+
+    lines = ['calculate_time summary']
+    for name, (calls, total) in stats:
+        lines.append('{:<32}{:>8} calls{:>12.3f} s{:>12.3f} ms/call'.format(name, calls, total, total / calls * 1000))
+    return '\n'.join(lines)
+
+
 # https://stackoverflow.com/questions/11731136/python-class-method-decorator-w-self-arguments
 # NOTE: if you wan't to use this decorator on a function, you must enclose the signal in a lambda
 # That way, it passes the function itself as an argument instead of a flag (bool)
 def calculate_time_class_method(f):
     @wraps(f)
     def wrap(*args, **kwargs):
-        before = time.time()
-        result = f(*args, **kwargs)
-        elapsed = time.time() - before
-        speed_logger.info('function "{}" took {} seconds'
-                          .format(f.__name__, elapsed))
-        return result
+        return _profile_call(f, args, kwargs, with_call_info=False)
     return wrap
 
 def calculate_time(f):
     @wraps(f)
     def wrap(*args, **kwargs):
-        before = time.time()
-        result = f(*args, **kwargs)
-        elapsed = time.time() - before
-
-        result_for_log = ''
-        if result:
-            if isinstance(result, (str, list, dict)):
-                result_for_log = str(result)
-                if len(result_for_log) > 200:
-                    result_for_log = result_for_log[:200]
-
-        speed_logger.info('function "{}" took {} seconds '
-                          '\t| args: {} '
-                          '\t| kwargs: {} '
-                          '\t| result: {}'
-                          .format(f.__name__, elapsed, str(args), str(kwargs), result_for_log))
-        return result
+        return _profile_call(f, args, kwargs, with_call_info=True)
     return wrap
 
 
@@ -158,32 +219,30 @@ def extract_kanji(text: str) -> list or None:
 
 
 def try_access_site(site,
-                    sleep_time=0.08,
-                    num_retries=3,
+                    sleep_time=None,
+                    num_retries=None,
                     wait_time=15.0,
-                    timeout=5):
-
-    initial_time = time.time()
-    time_margin = 0.02
-
-    response = None
-    try:
-        response = urllib.request.urlopen(site, timeout=timeout)
-
-    except:
-        for i in range(num_retries):
-            lapsed_time = time.time()
-            if lapsed_time - initial_time > wait_time: return None
-
-            try:
-                response = urllib.request.urlopen(site, timeout=timeout)
-            except:
-                # does something like random.uniform(0.06, 0.10)
-                sleep_time = random.uniform(sleep_time - time_margin,
-                                            sleep_time + time_margin)
-                time.sleep(sleep_time)
-    finally:
-        return response
+                    timeout=None,
+                    revalidate=False) -> bytes or None:
+    """
+    Goes through the shared http_client (keep-alive, per-host limits, backoff, ETag/Last-Modified revalidation)
+    Args:
+        sleep_time:     base delay of the exponential backoff between retries
+        num_retries:    retries after the first attempt
+        wait_time:      no new attempt is started once this many seconds have passed
+        timeout:        per-request timeout
+        revalidate:     ask the site even if the response cache has a fresh copy,
+                        None is returned (instead of the saved page) if the site can't be reached
+        (None means the http_backoff, http_retries and http_timeout configs)
+    Returns:
+        the body of the response, None if the site couldn't be reached
+    """
+    return http_client.get(site,
+                           num_retries=num_retries,
+                           wait_time=wait_time,
+                           timeout=timeout,
+                           backoff=sleep_time,
+                           revalidate=revalidate)
 
 
 def bs_remove_html(html):
@@ -200,56 +259,147 @@ def bs_remove_html(html):
     return ' '.join(soup.stripped_strings)
 
 
-@calculate_time
-def download_image(online_url, filename, use_inside_anki=True):
+def media_folder_path(use_inside_anki=True) -> str:
     """
-    https://stackoverflow.com/questions/37158246/how-to-download-images-from-beautifulsoup
+    Inside Anki this reads the collection, so only call it on the main thread
     Args:
-        filename:           the name of the file to be saved as,
-                            usually diff from the online_url because I added a string preceding it
         use_inside_anki:    default val= True
                             Set this to False for testing purposes, when not using inside Anki
     """
-
     # had to use mw.col.media.dir() inside a function because mw.col.media.dir() is called
     # at runtime when Anki starts, and since mw isn't loaded yet, it'll cause an error (not media method for NoneType)
-    if use_inside_anki:
-        current_col_media_path = mw.col.media.dir() or r'C:\Users\Mi\AppData\Roaming\Anki2\User 1\collection.media'
-    else:
-        current_col_media_path = config.get('media_debug_folder')
+    mw = main_window()
+    if use_inside_anki and mw is not None:
+        return mw.col.media.dir() or r'C:\Users\Mi\AppData\Roaming\Anki2\User 1\collection.media'
+    return config.get('media_debug_folder')
 
-    complete_file_location = os.path.join(current_col_media_path, filename)
 
-    time_margin = 0.02
-    sleep_time = 0.08
-    if not os.path.isfile(complete_file_location):
-        try:
-            with open(complete_file_location, 'wb') as f:
+def media_file_path(filename, use_inside_anki=True) -> str:
+    return os.path.join(media_folder_path(use_inside_anki), filename)
 
-                request = None
-                try:
-                    request = requests.get(online_url)
 
-                except:
-                    for i in range(15):
-                        try:
-                            request = requests.get(online_url)
-                        except Exception as e:
-                            sleep_time = random.uniform(sleep_time - time_margin,
-                                                        sleep_time + time_margin)
-                            time.sleep(sleep_time)
+def _fetch_image(session: requests.Session, online_url, complete_file_location) -> bool:
+    """
+    Streams the image into a temp file next to complete_file_location, then renames it
+    so that a failed download never leaves a half-written (or empty) file behind
+    Returns:
+        True if the image was saved
+    """
+    # an empty file is what a failed download used to leave behind, don't treat it as already downloaded
+    if os.path.isfile(complete_file_location) and os.path.getsize(complete_file_location) > 0:
+        return True
+
+    with metrics.stage('image_download'):
+        time_margin = 0.02
+        sleep_time = 0.08
+        for i in range(config.get('image_download_retries')):
+            temp_file_location = '{}.{}.part'.format(complete_file_location, threading.get_ident())
+            try:
+                with session.get(online_url, stream=True, timeout=config.get('image_download_timeout')) as request:
+                    request.raise_for_status()
+                    with open(temp_file_location, 'wb') as f:
+                        for chunk in request.iter_content(chunk_size=16 * 1024):
+                            f.write(chunk)
 
-                finally:
-                    if request: f.write(request.content)
+                if os.path.getsize(temp_file_location) > 0:
+                    os.replace(temp_file_location, complete_file_location)
+                    return True
 
+            except Exception as e:
+                sleep_time = random.uniform(sleep_time - time_margin,
+                                            sleep_time + time_margin)
+                time.sleep(sleep_time)
 
-        except Exception as e:
-            # showInfo('Could not save image {} because {}'.format(filename, e) )
-            pass
+            finally:
+                if os.path.isfile(temp_file_location):
+                    os.remove(temp_file_location)
+
+        return False
+
+
+class ImageDownloader:
+    """
+    Downloads the etymology images of a whole batch in the background
+
+    All downloads share one keep-alive requests session and run on a small thread pool
+    (image_download_workers), each online URL is only downloaded once per batch
+
+    Usage:
+        image_downloader.submit(online_url, filename)   # returns right away
+        ...
+        image_downloader.wait()                         # at the end of the batch
+    """
+    def __init__(self):
+        self._session   = None
+        self._executor  = None
+        # online url -> Future
+        self._futures   = dict()
+        self._lock      = threading.Lock()
+
+
+    @property
+    def session(self) -> requests.Session:
+        with self._lock:
+            if self._session is None:
+                pool_size = config.get('image_download_workers')
+                adapter = requests.adapters.HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+                self._session = requests.Session()
+                self._session.mount('https://', adapter)
+                self._session.mount('http://', adapter)
+            return self._session
+
+
+    def submit(self, online_url, filename, use_inside_anki=True, media_folder=None) -> Future:
+        """
+        Args:
+            media_folder:   folder to save the image in, see media_folder_path()
+                            callers running off the main thread have to pass the one they resolved on it
+        """
+        if media_folder is None:
+            media_folder = media_folder_path(use_inside_anki)
+        complete_file_location = os.path.join(media_folder, filename)
+        session = self.session
+
+        with self._lock:
+            future = self._futures.get(online_url)
+            if future is None:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=config.get('image_download_workers'))
+                future = self._executor.submit(_fetch_image, session, online_url, complete_file_location)
+                self._futures[online_url] = future
+
+        return future
+
+
+    def wait(self):
+        """
+        Blocks until every submitted image is downloaded (or failed)
+        """
+        with self._lock:
+            futures = list(self._futures.values())
+            self._futures.clear()
+
+        for future in futures:
+            try: future.result()
+            except Exception: pass
+
+
+image_downloader = ImageDownloader()
+
+
+@calculate_time
+def download_image(online_url, filename, use_inside_anki=True):
+    """
+    https://stackoverflow.com/questions/37158246/how-to-download-images-from-beautifulsoup
+    Blocking download of a single image, batches should use image_downloader.submit() instead
+    Args:
+        filename:           the name of the file to be saved as,
+                            usually diff from the online_url because I added a string preceding it
+        use_inside_anki:    default val= True
+                            Set this to False for testing purposes, when not using inside Anki
+    """
+    return image_downloader.submit(online_url, filename, use_inside_anki).result()
 
-    else:
-        print('file already exists')
-        pass
 
 if __name__ == '__main__':
     # from pprint import pprint
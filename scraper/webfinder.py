@@ -2,24 +2,35 @@
 # Copyright: Tanaka Aiko (https://github.com/aiko-tanaka)
 # License: GNU AGPL, version 3 or later; https://www.gnu.org/licenses/agpl-3.0.en.html
 
-from .consts import LABEL_PROGRESS_UPDATE, LABEL_MENU
+from .consts import LABEL_PROGRESS_UPDATE, LABEL_MENU, LABEL_UNDO, LABEL_MENU_RERENDER, LABEL_RERENDER_PROMPT
 from .config import config
 
-from .utils import extract_kanji, download_image, calculate_time_class_method, speed_logger
-from .online_dictionaries import okjiten_etymology
+from .utils import extract_kanji, image_downloader, media_folder_path, calculate_time_class_method, call_stats_summary, \
+    speed_logger
+from .online_dictionaries import okjiten_etymology, okjiten_listed, clear_failed_lookups
 from .offline_dictionaries import kanjidic2_info
-from .kanji_mecab import generate_furigana
+from .kanji_mecab import cached_furigana
+from .kanji_cache import commit_caches
+from .http_client import http_client
+from .regen_journal import RegenJournal
+from .note_index import note_index
+from .render import kanji_segment, render_field
+from .metrics import metrics
+
+from collections import OrderedDict, Counter
+from concurrent.futures import Future
+
+import threading
+import time
 
 from PyQt5.QtWidgets import *
 from PyQt5.QtCore import *
 from PyQt5.QtGui import *
 from anki.hooks import addHook
-from aqt.utils import showInfo
+from aqt.utils import showInfo, getText
 from aqt import mw
 
 
-# TODO: Priority 1 - get a list of all kanji available @ okjiten, check that list if the kanji is in the list
-# to avoid long querying times
 # TODO: Priority #2 - change tangorin waiting time (for handling cases such as kyuujitai not being found)
 # TODO: Priority 2.5 try searching KANJIGEN for etym if etym not found in okjiten
 # TODO: better progress dialog lol
@@ -47,6 +58,10 @@ force_update        = config.get('force_update')
 class Regen:
     """
     Used to organize the work flow to update the selected cards
+
+    The selection is processed in chunks of regen_chunk_size notes: the kanji of a chunk are resolved,
+    its notes rendered and written, then the chunk is recorded in the RegenJournal. A cancelled or
+    crashed run keeps every chunk already written, and running it again on the same notes continues from there
     Attributes
     ----------
     ed :
@@ -55,176 +70,369 @@ class Regen:
         List of selected cards
     completed : int
         Track how many cards were already processed
+    force_update : bool
+        overwrite kanji_etym_field even if it's already filled, force=None uses the force_update config
     """
-    def __init__(self, ed=None, fids=None):
+    def __init__(self, ed=None, fids=None, force=None):
         self.ed         = ed
         # ed.selectedNotes
         self.fids       = fids
+        self.force_update = force_update if force is None else force
         self.completed  = 0
+        self.cancelled  = threading.Event()
+        self.journal    = RegenJournal(self.fids)
+        self._undo_entry = None
+        # reason -> number of notes left untouched, by the planning pass or because okjiten couldn't be reached
+        self.skipped    = Counter()
+        # host -> requests skipped because the site was unreachable, see http_client.CircuitBreaker
+        self.skipped_hosts = dict()
+        self._last_progress = 0.0
+        # the images are queued from the background thread in generate_in_background(),
+        # where the collection can't be read
+        self.media_folder = media_folder_path()
         if len(self.fids) == 1:
             # Single card selected, need to deselect it before updating
             self.row = self.ed.currentRow()
             self.ed.form.tableView.selectionModel().clear()
         mw.progress.start(max=len(self.fids), immediate=True)
+
+        # notes already written by an interrupted run on the same selection
+        if self.journal.completed_notes:
+            self.completed = len(self.journal.completed_notes.intersection(self.fids))
+            speed_logger.info('resuming: {} notes already done, {} kanji already resolved'.format(
+                self.completed, len(self.journal.resolved_kanji)))
         mw.progress.update(
             label=LABEL_PROGRESS_UPDATE,
-            value=0)
+            value=self.completed)
 
 
-    def _update_progress(self):
-        self.completed += 1
+    def _update_progress(self, count=1):
+        """
+        Main thread only, the progress dialog is redrawn at most every progress_interval_ms
+        """
+        self.completed += count
+        now = time.perf_counter()
+        if (now - self._last_progress) * 1000 < config.get('progress_interval_ms') \
+                and self.completed < len(self.fids):
+            return
+        self._last_progress = now
         mw.progress.update(
             label=LABEL_PROGRESS_UPDATE,
             value=self.completed)
-        if self.completed >= len(self.fids):
-            mw.progress.finish()
-            return
+
+
+    def _check_cancel(self):
+        # ProgressManager.want_cancel() only exists in newer Anki versions
+        want_cancel = getattr(mw.progress, 'want_cancel', None)
+        if want_cancel and want_cancel():
+            self.cancelled.set()
 
 
     @calculate_time_class_method
     def generate(self):
         """
-        Generate Kanji Etymology strings
+        Generate Kanji Etymology strings, blocks until every note is done
         """
+        try:
+            self._generate_notes(on_main=lambda callback: callback(), from_main=lambda func: func())
+        finally:
+            self._end_of_run()
+        self._report()
 
-        if not __name__ == '__main__':
-            fs = [mw.col.getNote(id=fid) for fid in self.fids]
-        else:
-            # if run inside pycharm, self.finds would be a list of vocab
-            # fs = [fid for fid in self.fids]
-            pass
 
-        for f in fs:
-            if __name__ != '__main__':
-                # empty vocab field
-                if not f[vocab_field]:
-                    self._update_progress()
-                    continue
+    def generate_in_background(self, on_done=None):
+        """
+        Same as generate(), but scraping, parsing and rendering run on Anki's background thread pool,
+        only the collection reads and writes and the progress updates are sent back to the main thread
+        """
+        def from_main(func):
+            # runs func on the main thread and waits for its result
+            result = Future()
+            def run():
+                try:
+                    result.set_result(func())
+                except Exception as e:
+                    result.set_exception(e)
+            mw.taskman.run_on_main(run)
+            return result.result()
+
+        def task():
+            try:
+                self._generate_notes(on_main=mw.taskman.run_on_main, from_main=from_main)
+            finally:
+                self._end_of_run()
+
+        # Esc is noticed within progress_interval_ms, not only once a whole chunk is written
+        cancel_timer = mw.progress.timer(config.get('progress_interval_ms'), self._check_cancel, True)
+
+        def done(future):
+            cancel_timer.stop()
+            try:
+                future.result()
+            except Exception as e:
+                mw.progress.finish()
+                showInfo('error from generate() function, - {}'.format(str(e)))
             else:
-                # vocab = f['vocab_field']
-                pass
+                self._report()
+            if on_done:
+                on_done()
+
+        mw.taskman.run_in_background(task, done)
+
+
+    def _end_of_run(self):
+        with metrics.stage('image_wait'):
+            image_downloader.wait()
+        with metrics.stage('cache_write'):
+            commit_caches()
+        clear_failed_lookups()
+        if metrics.enabled:
+            speed_logger.info(metrics.summary())
+            metrics.reset()
+        if config.get('profiling_mode') != 'off':
+            speed_logger.info(call_stats_summary())
+
+        self.skipped_hosts = http_client.skipped_hosts()
+        if self.skipped_hosts:
+            speed_logger.info('skipped hosts (circuit open): {}'.format(self.skipped_hosts))
+
+
+    def _report(self):
+        mw.progress.finish()
+        speed_logger.info('----------------------------------------')
+
+        skipped = ''
+        if self.skipped:
+            skipped = '\n\nLeft as they are (the okjiten ones are done on the next run):\n' + '\n'.join(
+                '{}: {}'.format(reason, count) for reason, count in self.skipped.most_common())
+            speed_logger.info('skipped notes: {}'.format(dict(self.skipped)))
+
+        if self.skipped_hosts:
+            skipped += '\n\nUnreachable, skipped for a while (saved pages were used):\n' + '\n'.join(
+                '{}: {} requests'.format(host, count) for host, count in self.skipped_hosts.items())
+
+        if self.cancelled.is_set():
+            showInfo('Cancelled, {} out of {} notes done. '
+                     'Run it again on the same notes to continue where it stopped{}'.format(self.completed,
+                                                                                             len(self.fids),
+                                                                                             skipped))
+        else:
+            showInfo('Extraction done for {} out of {} notes done{}'.format(self.completed, len(self.fids), skipped))
 
 
+    def _filter_notes(self, fs) -> (list, list, list):
+        """
+        Planning pass, drops the notes that wouldn't change before any network or parse work
+        Returns:
+            todo:               notes to render
+            kanji_per_note:     the extracted kanji of each of those notes
+            skipped:            notes left as they are, the reasons are counted in self.skipped
+        """
+        todo, kanji_per_note, skipped = [], [], []
+        for f in fs:
             vocab = f[vocab_field]
-            if vocab:
-                vocab = str(vocab)
-                kanji_only = extract_kanji(vocab)
-            else:
-                self._update_progress()
-                continue
 
-            if kanji_only:
-                etym_info_list = okjiten_etymology(kanji_only)
+            if self.force_update is False and f[kanji_etym_field]:
+                reason = 'field already filled'
+            elif not vocab:
+                reason = 'empty vocab'
             else:
-                self._update_progress()
-                continue
+                kanji_only = extract_kanji(str(vocab))
+                if kanji_only:
+                    todo.append(f)
+                    kanji_per_note.append(kanji_only)
+                    continue
+                reason = 'no kanji in vocab'
 
-            okjiten_str = ''
-
-            kanji_with_etym = []
-            if etym_info_list:
-                for index, etym_info in enumerate(etym_info_list, start=1):
-                    etym_info: dict
-                    kanji           = etym_info.get('kanji')
-                    kanji_with_etym.append(kanji)
-
-                    definition      = etym_info.get('definition', None)
-                    etymology_text  = etym_info.get('etymology_text')
-                    etymology_text  = generate_furigana(etymology_text)
-                    anki_img_url    = etym_info.get('anki_img_url')
-                    online_img_url  = etym_info.get('online_img_url')
-
-                    try:
-                        src = etym_info.get('src')
-                        LABEL_PROGRESS_UPDATE = '{} from {}'.format(LABEL_PROGRESS_UPDATE, src)
-                    except:
-                        pass
-
-                    image_filename  = etym_info.get('image_filename')
-
-                    kanji_and_def = '{}({})'.format(kanji, definition)
-
-                    if online_img_url and image_filename:
-                        download_image(online_img_url, image_filename)
-
-                    # use <pseudo-newline> for JS-splitting inside anki because I already use <br> inside
-                    # etymology_text  = etym_info['etymology_text'] to replace the character '※'
-                    if index < len(etym_info_list):
-                        okjiten_str += '{} | {} | {}<pseudo-newline>'.format(kanji_and_def, anki_img_url, etymology_text)
-                    elif index == len(etym_info_list):
-                        okjiten_str += '{} | {} | {}'.format(kanji_and_def, anki_img_url, etymology_text)
-
-            found_in_kd2 = False
-            if any([k not in kanji_with_etym for k in kanji_only]):
-                not_found = [k for k in kanji_only if k not in kanji_with_etym]
-                for index, kanji in enumerate(not_found, start=1):
-                    definition = kanjidic2_info(kanji)
-
-                    if definition:
-                        kanji_and_def = '{}({})'.format(kanji, definition)
-                        found_in_kd2 = True
-
-                        if index == 1:
-                            # very important, adds a newline after okjiten etymology
-                            okjiten_str += f'<pseudo-newline>{kanji_and_def} | | '
-                        elif index < len(not_found):
-                            okjiten_str += f'{kanji_and_def} | | <pseudo-newline>'
-                        elif index == len(not_found):
-                            okjiten_str += f'{kanji_and_def} |  | '
-
-
-            if not etym_info_list and not found_in_kd2:
-                self._update_progress()
+            self.skipped[reason] += 1
+            skipped.append(f)
+
+        return todo, kanji_per_note, skipped
+
+
+    def _resolve_kanji(self, kanji_per_note) -> (dict, dict, dict, dict):
+        """
+        Resolves each unique kanji of the chunk only once, so network and cache work
+        scale with the number of unique kanji instead of kanji occurrences
+        Returns:
+            etym_by_kanji:          kanji -> okjiten etym info
+            definition_by_kanji:    kanji -> kanjidic2 definition, for the kanji that aren't on okjiten
+            furigana_by_text:       etymology text -> furigana, every text goes through MeCab at most once
+            unresolved_kanji:       kanji -> reason, for the kanji that may be on okjiten but couldn't be scraped:
+                                    listed on okjiten but the kanji page couldn't be fetched (or its circuit is open),
+                                    or missing from an incomplete okjiten index (see okjiten_listed())
+        """
+        unique_kanji = list(OrderedDict.fromkeys(kanji
+                                                 for kanji_only in kanji_per_note if kanji_only
+                                                 for kanji in kanji_only))
+
+        etym_by_kanji = dict()
+        if unique_kanji:
+            for etym_info in okjiten_etymology(unique_kanji, cancelled=self.cancelled):
+                etym_by_kanji[etym_info.get('kanji')] = etym_info
+
+        unresolved_kanji = dict()
+        definition_by_kanji = dict()
+        for kanji in unique_kanji:
+            if kanji in etym_by_kanji:
                 continue
+            listed = okjiten_listed(kanji)
+            if listed is None:
+                unresolved_kanji[kanji] = 'okjiten index unreachable'
+            elif listed:
+                unresolved_kanji[kanji] = 'okjiten page unreachable'
+            else:
+                definition_by_kanji[kanji] = kanjidic2_info(kanji)
 
+        with metrics.stage('furigana'):
+            furigana_by_text = cached_furigana([etym_info.get('etymology_text')
+                                                for etym_info in etym_by_kanji.values()])
 
-            okjiten_str = okjiten_str.replace(r'\n', '').strip()
+        return etym_by_kanji, definition_by_kanji, furigana_by_text, unresolved_kanji
 
-            # the vocab might not contain any Kanji AT ALL
-            if not okjiten_str:
-                self._update_progress()
+
+    def _generate_notes(self, on_main, from_main):
+        """
+        Args:
+            on_main:    runs a callable on the main thread (note writes, progress and journal updates)
+            from_main:  runs a callable on the main thread and returns its result (note reads)
+        """
+        chunk_size = config.get('regen_chunk_size')
+        for start in range(0, len(self.fids), chunk_size):
+            if self.cancelled.is_set():
+                return
+
+            chunk_fids = self.fids[start:start + chunk_size]
+            # the collection can only be read on the main thread
+            fs = from_main(lambda chunk_fids=chunk_fids:
+                           [mw.col.getNote(id=fid) for fid in chunk_fids if fid not in self.journal.completed_notes])
+            if not fs:
                 continue
 
+            todo, kanji_per_note, skipped = self._filter_notes(fs)
+            etym_by_kanji, definition_by_kanji, furigana_by_text, unresolved_kanji = self._resolve_kanji(kanji_per_note)
+            # cancelled while the chunk was being scraped, what was resolved is in the cache for the next run
+            if self.cancelled.is_set():
+                return
+
+            # rather than rendering them with kanjidic2 only, the notes are left as they are (and out of the journal)
+            # for a run where okjiten is reachable
+            retry_later = []
+            if unresolved_kanji:
+                rendered = []
+                for f, kanji_only in zip(todo, kanji_per_note):
+                    reasons = [unresolved_kanji[kanji] for kanji in kanji_only if kanji in unresolved_kanji]
+                    if reasons:
+                        self.skipped[reasons[0]] += 1
+                        retry_later.append(f)
+                    else:
+                        rendered.append((f, kanji_only))
+                todo = [f for f, kanji_only in rendered]
+                kanji_per_note = [kanji_only for f, kanji_only in rendered]
+
+            okjiten_segments, kd2_segments = self._render_segments(etym_by_kanji, definition_by_kanji, furigana_by_text)
+
+            results = [(f, render_field(kanji_only, okjiten_segments, kd2_segments))
+                       for f, kanji_only in zip(todo, kanji_per_note)]
+            results.extend((f, None) for f in skipped + retry_later)
+
+            # the kanji have to be saved before the chunk is journaled
+            with metrics.stage('cache_write'):
+                commit_caches()
+            chunk_kanji = list(etym_by_kanji.keys()) + list(definition_by_kanji.keys())
+            retry_ids = {f.id for f in retry_later}
+            on_main(lambda results=results, chunk_kanji=chunk_kanji, retry_ids=retry_ids:
+                    self._write_notes(results, chunk_kanji, retry_ids))
+
+        # queued after the last chunk's write, so the journal isn't recreated once it's deleted
+        on_main(self._finish_journal)
+
+
+    def _finish_journal(self):
+        if not self.cancelled.is_set():
+            self.journal.finish()
+
+
+    def _render_segments(self, etym_by_kanji, definition_by_kanji, furigana_by_text) -> (dict, dict):
+        """
+        Renders each kanji of the chunk once (see render.py), and queues its etymology image
+        Returns:
+            okjiten_segments:   kanji -> segment, for the kanji found on okjiten
+            kd2_segments:       kanji -> segment, for the other kanji that have a kanjidic2 definition
+        """
+        okjiten_segments = dict()
+        for kanji, etym_info in etym_by_kanji.items():
+            etym_info: dict
+            online_img_url  = etym_info.get('online_img_url')
+            image_filename  = etym_info.get('image_filename')
+
+            # downloaded in the background, each image only once per batch
+            if online_img_url and image_filename:
+                image_downloader.submit(online_img_url, image_filename, media_folder=self.media_folder)
+
+            okjiten_segments[kanji] = kanji_segment(kanji,
+                                                    etym_info.get('definition', None),
+                                                    etym_info.get('anki_img_url'),
+                                                    furigana_by_text.get(etym_info.get('etymology_text'), ''))
+
+        kd2_segments = {kanji: kanji_segment(kanji, definition)
+                        for kanji, definition in definition_by_kanji.items() if definition}
+
+        return okjiten_segments, kd2_segments
+
+
+    def _write_notes(self, results, chunk_kanji, retry_ids=frozenset()):
+        """
+        Main thread only, writes the rendered strings of a chunk in one transaction
+        then records it in the journal, except for the notes in retry_ids
+        """
+        # the chunk was queued before the run was cancelled, nothing more is written once it is
+        if self.cancelled.is_set():
+            return
+
+        changed_notes = []
+        for f, okjiten_str in results:
             try:
                 # kanji etymology field already contains something
-                if force_update is False and f[kanji_etym_field]:
+                if okjiten_str is None or (self.force_update is False and f[kanji_etym_field]):
                     # do nothing, count it as progress
                     self._update_progress()
-                    # mw.progress.finish()
                     continue
 
-                # kanji etym field is empty, fill it
-                elif not f[kanji_etym_field]:
-                    f[kanji_etym_field] = okjiten_str
-                    self._update_progress()
-                    # mw.progress.finish()
-
-                elif force_update and f[kanji_etym_field]:
+                if f[kanji_etym_field] != okjiten_str:
                     f[kanji_etym_field] = okjiten_str
-                    self._update_progress()
-                    # mw.progress.finish()
-
-                else:
-                    pass
+                    changed_notes.append(f)
+                self._update_progress()
 
             except Exception as e:
                 showInfo('error from generate() function, - {}'.format(str(e)))
 
-            try:
-                f.flush()
-            except Exception as e:
-                pass
+        if changed_notes:
+            with metrics.stage('note_commit'):
+                self._commit_notes(changed_notes)
 
-            # just a fail-safe
-            if self.completed >= len(self.fids):
-                mw.progress.finish()
-                speed_logger.info('----------------------------------------')
-                showInfo('Extraction done for {} out of {} notes done'.format(
-                                                                        self.completed,
-                                                                        len(self.fids)
-                                                                        ))
+        self.journal.record([f.id for f, okjiten_str in results if f.id not in retry_ids], chunk_kanji)
+        self._check_cancel()
 
-                return
+
+    def _commit_notes(self, notes: list):
+        """
+        Saves the notes through the collection's bulk update, every chunk of the run is merged
+        into a single undo entry
+        """
+        # Collection.update_notes and the custom undo entries only exist since Anki 2.1.45
+        if not hasattr(mw.col, 'update_notes'):
+            for f in notes:
+                try:
+                    f.flush()
+                except Exception as e:
+                    pass
+            return
+
+        if self._undo_entry is None:
+            self._undo_entry = mw.col.add_custom_undo_entry(LABEL_UNDO)
+        mw.col.update_notes(notes)
+        mw.col.merge_undo_entries(self._undo_entry)
 
 
 def setup_menu(ed):
@@ -236,6 +444,10 @@ def setup_menu(ed):
     ed.form.menuEdit.addAction(a)
     a.setShortcut(QKeySequence(keybinding))
 
+    rerender = QAction(LABEL_MENU_RERENDER, ed)
+    rerender.triggered.connect(lambda _, e=ed: on_rerender_kanji(e))
+    ed.form.menuEdit.addAction(rerender)
+
 
 def add_to_context_menu(view, menu):
     """
@@ -247,17 +459,62 @@ def add_to_context_menu(view, menu):
     a.setShortcut(QKeySequence(keybinding))
 
 
+def refresh_browser(ed):
+    """
+    Redraws the browser rows instead of a full mw.reset(), the main window redraws itself when it's next shown
+    """
+    # the browser table was rewritten in Anki 2.1.45
+    table = getattr(ed, 'table', None)
+    if table is not None:
+        table.redraw_cells()
+    else:
+        ed.model.reset()
+
+    if hasattr(mw, 'update_undo_actions'):
+        mw.update_undo_actions()
+    mw.requireReset()
+
+
 def on_regen_vocab(ed):
     """
     main function
     """
+    run_regen(ed, Regen(ed, ed.selectedNotes()))
 
+
+def run_regen(ed, regen: Regen):
     speed_logger.info('\n---------------START------------------')
-    regen = Regen(ed, ed.selectedNotes())
-    regen.generate()
-    mw.reset()
-    mw.requireReset()
-    speed_logger.info('-----------------END--------------------\n')
+
+    def on_done():
+        refresh_browser(ed)
+        speed_logger.info('-----------------END--------------------\n')
+
+    # mw.taskman only exists since Anki 2.1.22
+    if config.get('regen_in_background') and hasattr(mw, 'taskman'):
+        regen.generate_in_background(on_done=on_done)
+    else:
+        regen.generate()
+        on_done()
+
+def rerender_kanji(ed, kanji_list: list):
+    """
+    Re-renders only the notes whose vocab contains one of the kanji, e.g. after their etymology changed
+    """
+    note_index.refresh(mw.col, mw.pm.name)
+    fids = note_index.notes_with_kanji(kanji_list, mw.pm.name)
+    if not fids:
+        showInfo('No notes contain {}'.format(''.join(kanji_list)))
+        return
+
+    run_regen(ed, Regen(ed, fids, force=True))
+
+
+def on_rerender_kanji(ed):
+    text, accepted = getText(LABEL_RERENDER_PROMPT, parent=ed)
+    kanji_list = extract_kanji(text) if accepted else None
+    if kanji_list:
+        rerender_kanji(ed, kanji_list)
+
 
 addHook('browser.setupMenus', setup_menu)
 addHook('browser.onContextMenu', add_to_context_menu)
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+# Copyright: Tanaka Aiko (https://github.com/aiko-tanaka)
+# License: GNU AGPL, version 3 or later; https://www.gnu.org/licenses/agpl-3.0.en.html
+
+"""
+The AnkiConnect definition fallback of a whole chunk goes out in a bounded number of requests,
+against the AnkiConnect stand-in of benchmarks/standin.py
+"""
+
+import unittest
+import tempfile
+import math
+import json
+import sys
+import os
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.standin import Recordings, StandInServer
+from scraper import online_dictionaries, offline_dictionaries
+from scraper.offline_dictionaries import anki_connect, decks
+from scraper.config import config
+
+
+# 300 distinct kanji
+KANJI = [chr(0x4E00 + i) for i in range(300)]
+
+
+class AnkiConnectBatchTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.folder = tempfile.TemporaryDirectory()
+        with open(os.path.join(cls.folder.name, 'index.json'), 'w', encoding='utf8') as fh:
+            json.dump({}, fh)
+
+        cls.server = StandInServer(Recordings(cls.folder.name))
+        cls.server.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.stop()
+        cls.folder.cleanup()
+
+    def setUp(self):
+        self.address = (anki_connect.host, anki_connect.port)
+        anki_connect.host, anki_connect.port = '127.0.0.1', self.server.port
+        anki_connect._conn = None
+        self.server.reset()
+
+        self.okjiten_kanji_info = online_dictionaries.okjiten_kanji_info
+        self.okjiten_cache = online_dictionaries.okjiten_cache
+
+    def tearDown(self):
+        anki_connect.host, anki_connect.port = self.address
+        anki_connect._conn = None
+        online_dictionaries.okjiten_kanji_info = self.okjiten_kanji_info
+        online_dictionaries.okjiten_cache = self.okjiten_cache
+
+    def max_requests(self, kanji_count: int) -> int:
+        return math.ceil(kanji_count * (len(decks) + 1) / config.get('ankiconnect_batch_size'))
+
+    def test_batch_request_count(self):
+        kanji_info = offline_dictionaries.offline_kanji_info_batch(KANJI)
+
+        self.assertEqual(list(kanji_info), KANJI)
+        self.assertLessEqual(self.server.requests['ankiconnect'], self.max_requests(len(KANJI)))
+
+    def test_chunk_fallback_is_one_batch(self):
+        calls = []
+
+        def okjiten_kanji_info(kanji, ankiconnect=True):
+            calls.append(ankiconnect)
+            return {'kanji': kanji, 'definition': ''}
+
+        online_dictionaries.okjiten_kanji_info = okjiten_kanji_info
+        online_dictionaries.okjiten_cache = lambda *args, **kwargs: None
+
+        result_list = online_dictionaries.okjiten_etymology(KANJI)
+
+        self.assertEqual([kanji_info['kanji'] for kanji_info in result_list], KANJI)
+        # no kanji asked AnkiConnect on its own
+        self.assertEqual(set(calls), {False})
+        self.assertLessEqual(self.server.requests['ankiconnect'], self.max_requests(len(KANJI)))
+
+    def test_first_deck_with_the_kanji_wins(self):
+        card = lambda meaning: [{'fields': {'Meaning': {'value': meaning}}}]
+
+        kanji_info = offline_dictionaries._kanji_info_from_results('夢', [[], card('dream'), card('other')], [])
+        self.assertEqual(kanji_info['meaning'], 'dream')
+
+        kanji_info = offline_dictionaries._kanji_info_from_results('夢', [[], [], []], [])
+        self.assertNotIn('meaning', kanji_info)
+
+
+if __name__ == '__main__':
+    unittest.main()
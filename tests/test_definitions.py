@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+# Copyright: Tanaka Aiko (https://github.com/aiko-tanaka)
+# License: GNU AGPL, version 3 or later; https://www.gnu.org/licenses/agpl-3.0.en.html
+
+"""
+resolve_definition() against stub sources, nothing goes online
+"""
+
+import unittest
+import time
+import sys
+import os
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from scraper import online_dictionaries
+from scraper.config import config
+
+
+def stub_source(name: str, calls: list, definition: str, delay: float):
+    def lookup(kanji):
+        calls.append(name)
+        time.sleep(delay)
+        return definition
+    return lookup
+
+
+class ResolveDefinitionTest(unittest.TestCase):
+    def setUp(self):
+        self.sources = list(online_dictionaries.DEFINITION_SOURCES)
+        self.config = {key: config[key] for key in ('definition_hedge_delay', 'definition_deadline')}
+        config['definition_hedge_delay'] = 0.1
+        config['definition_deadline'] = 0.5
+        self.calls = []
+
+    def tearDown(self):
+        online_dictionaries.DEFINITION_SOURCES[:] = self.sources
+        config.update(self.config)
+
+    def use_sources(self, *sources):
+        online_dictionaries.DEFINITION_SOURCES[:] = [
+            (name, stub_source(name, self.calls, definition, delay)) for name, definition, delay in sources]
+
+    def test_fast_hit_starts_no_other_source(self):
+        self.use_sources(('kd', 'dream', 0.01), ('tg', 'tangorin dream', 0), ('ac', 'anki dream', 0))
+
+        self.assertEqual(online_dictionaries.resolve_definition('夢'), ('dream', 'kd'))
+        time.sleep(0.2)
+        self.assertEqual(self.calls, ['kd'])
+
+    def test_empty_source_falls_back_to_the_next_one(self):
+        self.use_sources(('kd', '', 0), ('tg', '', 0.01), ('ac', 'anki dream', 0))
+
+        before = time.monotonic()
+        self.assertEqual(online_dictionaries.resolve_definition('夢'), ('anki dream', 'ac'))
+        # every source came back empty before its hedge delay, nothing waited for it
+        self.assertLess(time.monotonic() - before, 0.1)
+        self.assertEqual(self.calls, ['kd', 'tg', 'ac'])
+
+    def test_slow_source_is_hedged(self):
+        self.use_sources(('kd', '', 0), ('tg', 'tangorin dream', 0.3), ('ac', 'anki dream', 0))
+
+        # tangorin still wins, the AnkiConnect lookup started after the hedge delay meanwhile
+        self.assertEqual(online_dictionaries.resolve_definition('夢'), ('tangorin dream', 'tg'))
+        self.assertEqual(self.calls, ['kd', 'tg', 'ac'])
+
+    def test_deadline_takes_the_best_answer_so_far(self):
+        self.use_sources(('kd', '', 0), ('tg', 'tangorin dream', 2), ('ac', 'anki dream', 0))
+
+        before = time.monotonic()
+        self.assertEqual(online_dictionaries.resolve_definition('夢'), ('anki dream', 'ac'))
+        self.assertLess(time.monotonic() - before, 0.5 + 0.1)
+
+    def test_nothing_found(self):
+        self.use_sources(('kd', '', 0), ('tg', '', 0), ('ac', '', 0))
+
+        self.assertEqual(online_dictionaries.resolve_definition('夢'), ('', None))
+
+
+if __name__ == '__main__':
+    unittest.main()
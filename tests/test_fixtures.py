@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+# Copyright: Tanaka Aiko (https://github.com/aiko-tanaka)
+# License: GNU AGPL, version 3 or later; https://www.gnu.org/licenses/agpl-3.0.en.html
+
+"""
+The synthetic benchmark pages of benchmarks/fixtures go through the whole scraper, served by the stand-in
+"""
+
+import unittest
+import tempfile
+import sys
+import os
+
+REPO_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_PATH)
+
+from benchmarks.standin import Recordings, StandInServer, StandInSession
+from scraper import online_dictionaries
+from scraper.kanji_cache import close_caches
+from scraper.http_client import http_client
+from scraper.config import config
+
+
+class FixturesTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.config = {key: config[key] for key in ('kanji_cache_path', 'offline_only', 'host_requests_per_second')}
+        close_caches()
+        config['kanji_cache_path'] = self.folder.name
+        config['offline_only'] = False
+        config['host_requests_per_second'] = 0
+        http_client._host_buckets.clear()
+
+        self.recordings = Recordings(os.path.join(REPO_PATH, 'benchmarks', 'fixtures'))
+        self.server = StandInServer(self.recordings)
+        self.server.start()
+        http_client._session = StandInSession(self.server.base)
+
+    def tearDown(self):
+        self.server.stop()
+        http_client._session = None
+        http_client._host_buckets.clear()
+        online_dictionaries._okjiten_index = None
+        close_caches()
+        config.update(self.config)
+        self.folder.cleanup()
+
+    def test_every_okjiten_kanji_resolves(self):
+        index = online_dictionaries.okjiten_index(refresh=True)
+        self.assertEqual(len(index), 30)
+
+        result_list = online_dictionaries.okjiten_etymology(list(index))
+        self.assertEqual([kanji_info['kanji'] for kanji_info in result_list], list(index))
+        for kanji_info in result_list:
+            self.assertTrue(online_dictionaries.is_complete_okjiten_info(kanji_info), kanji_info)
+
+    def test_dong_pages(self):
+        etymology = online_dictionaries.dong_etymology(['夢', '峠'])
+
+        self.assertIn('<b>夢</b>(dream)', etymology)
+        self.assertNotIn('峠', etymology)
+
+    def test_tangorin_pages(self):
+        self.assertEqual(online_dictionaries.tangorin_kanji_info('夢'), 'dream; vision; illusion')
+
+
+if __name__ == '__main__':
+    unittest.main()
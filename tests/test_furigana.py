@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+# Copyright: Tanaka Aiko (https://github.com/aiko-tanaka)
+# License: GNU AGPL, version 3 or later; https://www.gnu.org/licenses/agpl-3.0.en.html
+
+"""
+cached_furigana() against a stub mecab_controller, MeCab itself isn't needed
+"""
+
+import unittest
+import tempfile
+import types
+import sys
+import os
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from scraper import kanji_mecab
+from scraper.kanji_mecab import cached_furigana, furigana_store, text_digest, BATCH_SEPARATOR
+from scraper.config import config
+
+
+class StubController:
+    """
+    Reads 夢 as 夢[ゆめ], every query is recorded in `queries` (shared by every started controller)
+    """
+    queries = []
+    started = 0
+    # the first controller started loses the separators, like a MeCab that split a long line
+    broken_first = False
+
+    def __init__(self):
+        StubController.started += 1
+        self.broken = StubController.broken_first and StubController.started == 1
+
+    def reading(self, text, skip_words=None):
+        StubController.queries.append(text)
+        reading = text.replace('夢', '夢[ゆめ]')
+        return reading.replace(BATCH_SEPARATOR, '') if self.broken else reading
+
+
+class CachedFuriganaTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.config = {key: config[key] for key in ('kanji_cache_path', 'mecab_batch_max_bytes')}
+        furigana_store.close()
+        config['kanji_cache_path'] = self.folder.name
+
+        StubController.queries = []
+        StubController.started = 0
+        StubController.broken_first = False
+        self.controller_module = sys.modules.get('mecab_controller')
+        sys.modules['mecab_controller'] = types.SimpleNamespace(MecabController=StubController)
+        kanji_mecab.reset_mecab()
+
+    def tearDown(self):
+        kanji_mecab.reset_mecab()
+        if self.controller_module is None:
+            del sys.modules['mecab_controller']
+        else:
+            sys.modules['mecab_controller'] = self.controller_module
+        furigana_store._pending.clear()
+        furigana_store.close()
+        config.update(self.config)
+        self.folder.cleanup()
+
+    def test_batch_is_split_back_per_text(self):
+        furigana = cached_furigana(['夢を見た', '', '夢を見た', '本'])
+
+        self.assertEqual(furigana, {'夢を見た': '夢[ゆめ]を見た', '': '', '本': '本'})
+        self.assertEqual(StubController.queries, [BATCH_SEPARATOR.join(['夢を見た', '本'])])
+        self.assertEqual(furigana_store.get(text_digest('夢を見た')), '夢[ゆめ]を見た')
+
+        # cached, MeCab isn't asked again
+        cached_furigana(['夢を見た', '本'])
+        self.assertEqual(len(StubController.queries), 1)
+
+    def test_batches_stay_under_the_byte_cap(self):
+        config['mecab_batch_max_bytes'] = 40
+        texts = ['夢{}'.format(i) * 3 for i in range(10)]
+
+        furigana = cached_furigana(texts)
+
+        self.assertEqual(furigana, {text: text.replace('夢', '夢[ゆめ]') for text in texts})
+        self.assertGreater(len(StubController.queries), 1)
+        for query in StubController.queries:
+            if BATCH_SEPARATOR in query:
+                self.assertLessEqual(len(query.encode('utf8')), 40)
+
+    def test_texts_with_newlines_are_queried_alone(self):
+        cached_furigana(['夢\n見た', '本'])
+
+        self.assertEqual(sorted(StubController.queries), ['夢\n見た', '本'])
+
+    def test_failed_batch_restarts_mecab_and_isnt_cached(self):
+        StubController.broken_first = True
+
+        furigana = cached_furigana(['夢を見た', '本'])
+
+        # no per-text query on the same (out of step) controller
+        self.assertEqual(furigana, {'夢を見た': '', '本': ''})
+        self.assertEqual(len(StubController.queries), 1)
+        self.assertIsNone(furigana_store.get(text_digest('夢を見た')))
+
+        # a new controller is started for the next batch
+        furigana = cached_furigana(['夢を見た', '本'])
+        self.assertEqual(furigana, {'夢を見た': '夢[ゆめ]を見た', '本': '本'})
+        self.assertEqual(StubController.started, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
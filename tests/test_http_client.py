@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+# Copyright: Tanaka Aiko (https://github.com/aiko-tanaka)
+# License: GNU AGPL, version 3 or later; https://www.gnu.org/licenses/agpl-3.0.en.html
+
+"""
+Circuit breakers and token buckets of the http_client, against a stub session
+"""
+
+import unittest
+import tempfile
+import time
+import sys
+import os
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from scraper.http_client import http_client, TokenBucket, CircuitBreaker
+from scraper.response_cache import response_cache
+from scraper.config import config
+
+import requests
+
+
+URL = 'https://okjiten.jp/kanji1.html'
+
+
+class StubSession:
+    """
+    Answers with the given status, or raises a ConnectionError if it's None
+    """
+    def __init__(self, status=None):
+        self.status = status
+        self.requests = 0
+
+    def get(self, url, headers=None, timeout=None):
+        self.requests += 1
+        if self.status is None:
+            raise requests.ConnectionError(url)
+        response = requests.Response()
+        response.status_code = self.status
+        response._content = b'<html>page</html>'
+        return response
+
+
+class CircuitBreakerTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.config = {key: config[key] for key in ('kanji_cache_path', 'offline_only', 'http_retries',
+                                                    'host_requests_per_second', 'circuit_breaker_failures',
+                                                    'circuit_breaker_cooldown')}
+        response_cache.close()
+        config['kanji_cache_path'] = self.folder.name
+        config['offline_only'] = False
+        config['http_retries'] = 0
+        config['host_requests_per_second'] = 0
+        config['circuit_breaker_failures'] = 2
+        config['circuit_breaker_cooldown'] = 0.1
+        http_client._host_breakers.clear()
+        http_client._host_buckets.clear()
+
+    def tearDown(self):
+        http_client._session = None
+        http_client._host_breakers.clear()
+        http_client._host_buckets.clear()
+        response_cache.close()
+        config.update(self.config)
+        self.folder.cleanup()
+
+    def use_session(self, status=None) -> StubSession:
+        http_client._session = session = StubSession(status)
+        return session
+
+    def open_circuit(self):
+        # another page of the same host, the circuit is per host
+        session = self.use_session()
+        for attempt in range(2):
+            self.assertIsNone(http_client.get('https://okjiten.jp/kanji2.html'))
+        self.assertEqual(session.requests, 2)
+
+    def test_opens_after_failures_and_counts_skips(self):
+        self.open_circuit()
+        session = self.use_session(200)
+
+        self.assertIsNone(http_client.get(URL))
+        self.assertIsNone(http_client.get(URL))
+        self.assertEqual(session.requests, 0)
+
+        self.assertEqual(http_client.skipped_hosts(), {'okjiten.jp': 2})
+        # reset once read
+        self.assertEqual(http_client.skipped_hosts(), {})
+
+    def test_stale_page_is_served_while_open(self):
+        response_cache.store(URL, b'<html>saved</html>')
+        with response_cache._connect() as conn:
+            conn.execute('UPDATE responses SET fetched_at = 0')
+
+        self.open_circuit()
+        self.assertEqual(http_client.get(URL), b'<html>saved</html>')
+        # a revalidation isn't fooled by the saved page
+        self.assertIsNone(http_client.get(URL, revalidate=True))
+
+    def test_half_open_trial_closes_the_circuit(self):
+        self.open_circuit()
+        time.sleep(0.15)
+        session = self.use_session(200)
+
+        self.assertEqual(http_client.get(URL), b'<html>page</html>')
+        self.assertEqual(session.requests, 1)
+        breaker = http_client.host_breaker(URL)
+        self.assertIsNone(breaker.opened_at)
+        self.assertEqual(breaker.failures, 0)
+
+    def test_failed_trial_reopens_the_circuit(self):
+        self.open_circuit()
+        time.sleep(0.15)
+        session = self.use_session()
+
+        # a single failed trial is enough, not circuit_breaker_failures of them
+        self.assertIsNone(http_client.get(URL))
+        self.assertIsNone(http_client.get(URL))
+        self.assertEqual(session.requests, 1)
+        self.assertTrue(http_client.host_breaker(URL).is_open)
+
+        # and a new cool-down starts
+        time.sleep(0.15)
+        self.assertIsNone(http_client.get(URL))
+        self.assertEqual(session.requests, 2)
+
+    def test_single_trial_at_a_time(self):
+        breaker = CircuitBreaker()
+        for attempt in range(2):
+            breaker.failure()
+        time.sleep(0.15)
+
+        self.assertTrue(breaker.allow())
+        # the trial is still running
+        self.assertFalse(breaker.allow())
+        self.assertFalse(breaker.is_open)
+        self.assertEqual(breaker.skipped, 1)
+
+    def test_404_counts_as_reachable(self):
+        session = self.use_session(404)
+        for attempt in range(3):
+            self.assertIsNone(http_client.get(URL))
+        self.assertEqual(session.requests, 3)
+        self.assertFalse(http_client.host_breaker(URL).is_open)
+
+
+class TokenBucketTest(unittest.TestCase):
+    def test_burst_then_rate(self):
+        bucket = TokenBucket(rate=20, burst=3)
+
+        before = time.monotonic()
+        for attempt in range(3):
+            bucket.acquire()
+        self.assertLess(time.monotonic() - before, 0.03)
+
+        # the 4th token takes 1/20 s to come back
+        bucket.acquire()
+        self.assertGreaterEqual(time.monotonic() - before, 0.04)
+
+    def test_refill_is_capped_at_burst(self):
+        bucket = TokenBucket(rate=100, burst=2)
+        bucket.acquire()
+        time.sleep(0.1)
+
+        bucket.acquire()
+        # 10 tokens worth of time went by, but only burst of them are saved up
+        self.assertLessEqual(bucket._tokens, 1)
+
+    def test_no_rate_no_limit(self):
+        bucket = TokenBucket(rate=0, burst=1)
+        before = time.monotonic()
+        for attempt in range(100):
+            bucket.acquire()
+        self.assertLess(time.monotonic() - before, 0.05)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+# Copyright: Tanaka Aiko (https://github.com/aiko-tanaka)
+# License: GNU AGPL, version 3 or later; https://www.gnu.org/licenses/agpl-3.0.en.html
+
+"""
+Import of the legacy JSON caches into a KeyedCache
+"""
+
+import unittest
+import tempfile
+import json
+import sys
+import os
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from scraper.kanji_cache import KeyedCache
+from scraper.config import config
+
+
+class LegacyJsonTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.kanji_cache_path = config['kanji_cache_path']
+
+    def tearDown(self):
+        config['kanji_cache_path'] = self.kanji_cache_path
+        self.folder.cleanup()
+
+    def test_legacy_json_is_looked_up_when_the_cache_is_opened(self):
+        # the cache is created before kanji_cache_path changes, like okjiten_store before prewarm's arguments
+        cache = KeyedCache('legacy_test', legacy_json_key='okjiten_cache_filename')
+        config['kanji_cache_path'] = self.folder.name
+
+        json_path = os.path.join(self.folder.name, config['okjiten_cache_filename'])
+        with open(json_path, 'w', encoding='utf8') as fh:
+            json.dump({'夢': {'kanji': '夢', 'definition': 'dream'}}, fh, ensure_ascii=False)
+
+        try:
+            self.assertEqual(cache.get('夢'), {'kanji': '夢', 'definition': 'dream'})
+        finally:
+            cache.close()
+        self.assertTrue(os.path.isfile(json_path + '.migrated'))
+
+
+class CommitKeysTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.kanji_cache_path = config['kanji_cache_path']
+        config['kanji_cache_path'] = self.folder.name
+        self.cache = KeyedCache('commit_test')
+
+    def tearDown(self):
+        self.cache._pending.clear()
+        self.cache.close()
+        config['kanji_cache_path'] = self.kanji_cache_path
+        self.folder.cleanup()
+
+    def test_only_the_given_keys_are_written(self):
+        self.cache.put('夢', 'dream')
+        self.cache.put('本', 'book')
+        self.cache.commit(keys=['夢'])
+
+        rows = self.cache._connect().execute('SELECT key FROM commit_test').fetchall()
+        self.assertEqual(rows, [('夢',)])
+        self.assertEqual(list(self.cache._pending), ['本'])
+
+
+if __name__ == '__main__':
+    unittest.main()
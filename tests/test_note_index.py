@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+# Copyright: Tanaka Aiko (https://github.com/aiko-tanaka)
+# License: GNU AGPL, version 3 or later; https://www.gnu.org/licenses/agpl-3.0.en.html
+
+"""
+NoteIndex.refresh() against a stub collection, an in-memory sqlite notes table
+"""
+
+import unittest
+import tempfile
+import sqlite3
+import types
+import sys
+import os
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from scraper.note_index import note_index
+from scraper.config import config
+
+
+VOCAB_MODEL = 1
+OTHER_MODEL = 2
+
+
+class StubDB:
+    """
+    The col.db methods used by the index, every query is recorded in `queries`
+    """
+    def __init__(self):
+        self.conn = sqlite3.connect(':memory:')
+        self.conn.execute('CREATE TABLE notes (id INTEGER PRIMARY KEY, mid INTEGER, mod INTEGER, flds TEXT)')
+        self.queries = []
+
+    def all(self, sql, *args):
+        self.queries.append(sql)
+        return self.conn.execute(sql, args).fetchall()
+
+    def list(self, sql, *args):
+        return [row[0] for row in self.all(sql, *args)]
+
+    def scalar(self, sql, *args):
+        return self.all(sql, *args)[0][0]
+
+
+class StubCollection:
+    def __init__(self):
+        self.db = StubDB()
+        models = [{'id': VOCAB_MODEL, 'flds': [{'name': config['vocab_field']}, {'name': 'Meaning'}]},
+                  {'id': OTHER_MODEL, 'flds': [{'name': 'Front'}]}]
+        self.models = types.SimpleNamespace(all=lambda: models)
+
+    def save_note(self, note_id: int, mid: int, mod: int, *fields):
+        self.db.conn.execute('INSERT OR REPLACE INTO notes (id, mid, mod, flds) VALUES (?, ?, ?, ?)',
+                             (note_id, mid, mod, '\x1f'.join(fields)))
+
+    def remove_note(self, note_id: int):
+        self.db.conn.execute('DELETE FROM notes WHERE id = ?', (note_id,))
+
+
+class NoteIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.kanji_cache_path = config['kanji_cache_path']
+        note_index.close()
+        config['kanji_cache_path'] = self.folder.name
+
+        self.col = StubCollection()
+        self.col.save_note(1, VOCAB_MODEL, 10, '夢', 'dream')
+        self.col.save_note(2, VOCAB_MODEL, 10, '本', 'book')
+        self.col.save_note(3, OTHER_MODEL, 10, '夢')
+        self.col.save_note(4, VOCAB_MODEL, 10, 'ゆめ', 'dream')
+        note_index.refresh(self.col, 'profile')
+        self.col.db.queries.clear()
+
+    def tearDown(self):
+        note_index.close()
+        config['kanji_cache_path'] = self.kanji_cache_path
+        self.folder.cleanup()
+
+    def test_added_and_edited_notes(self):
+        self.col.save_note(2, VOCAB_MODEL, 20, '夢本', 'dream book')
+        self.col.save_note(5, VOCAB_MODEL, 20, '悪夢', 'nightmare')
+
+        note_index.refresh(self.col, 'profile')
+        self.assertEqual(note_index.notes_with_kanji(['夢'], 'profile'), [1, 2, 5])
+        self.assertEqual(note_index.notes_with_kanji(['本'], 'profile'), [2])
+        # no note was deleted, the note ids aren't all read
+        self.assertNotIn('SELECT id FROM notes', self.col.db.queries)
+
+    def test_deleted_notes(self):
+        self.col.remove_note(1)
+        # a note added in the same refresh doesn't hide the deleted one from the note count
+        self.col.save_note(5, OTHER_MODEL, 20, '夢')
+
+        note_index.refresh(self.col, 'profile')
+        self.assertEqual(note_index.notes_with_kanji(['夢'], 'profile'), [])
+        self.assertIn('SELECT id FROM notes', self.col.db.queries)
+
+        # the note count is right again
+        self.col.db.queries.clear()
+        note_index.refresh(self.col, 'profile')
+        self.assertNotIn('SELECT id FROM notes', self.col.db.queries)
+
+    def test_profiles_are_indexed_apart(self):
+        self.assertEqual(note_index.notes_with_kanji(['夢'], 'other profile'), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+# Copyright: Tanaka Aiko (https://github.com/aiko-tanaka)
+# License: GNU AGPL, version 3 or later; https://www.gnu.org/licenses/agpl-3.0.en.html
+
+"""
+okjiten_index() and okjiten_listed() when some of the okjiten index pages can't be reached
+"""
+
+import unittest
+import tempfile
+import sys
+import os
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from scraper import online_dictionaries
+from scraper.config import config
+
+
+class OkjitenIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.kanji_cache_path = config['kanji_cache_path']
+        config['kanji_cache_path'] = self.folder.name
+
+        self.build_okjiten_index = online_dictionaries.build_okjiten_index
+        self.builds = 0
+        online_dictionaries._okjiten_index = None
+
+    def tearDown(self):
+        online_dictionaries.build_okjiten_index = self.build_okjiten_index
+        online_dictionaries._okjiten_index = None
+        online_dictionaries._okjiten_index_incomplete = False
+        config['kanji_cache_path'] = self.kanji_cache_path
+        self.folder.cleanup()
+
+    def use_build(self, index: dict, complete: bool):
+        def build():
+            self.builds += 1
+            return dict(index), complete
+        online_dictionaries.build_okjiten_index = build
+
+    def test_incomplete_first_build(self):
+        self.use_build({'夢': ['page', 'kanji1.html']}, complete=False)
+
+        self.assertIs(online_dictionaries.okjiten_listed('夢'), True)
+        # might be listed on the unreachable page
+        self.assertIsNone(online_dictionaries.okjiten_listed('本'))
+        # nothing saved, the next session builds it again
+        self.assertEqual(os.listdir(self.folder.name), [])
+
+    def test_failed_build_is_remembered(self):
+        self.use_build({}, complete=False)
+
+        for kanji in '夢本木':
+            self.assertIsNone(online_dictionaries.okjiten_listed(kanji))
+        self.assertEqual(self.builds, 1)
+
+    def test_complete_build(self):
+        self.use_build({'夢': ['page', 'kanji1.html']}, complete=True)
+
+        self.assertIs(online_dictionaries.okjiten_listed('夢'), True)
+        self.assertIs(online_dictionaries.okjiten_listed('本'), False)
+
+        # saved, a new session loads it without building it again
+        online_dictionaries._okjiten_index = None
+        self.assertEqual(online_dictionaries.okjiten_index(), {'夢': ['page', 'kanji1.html']})
+        self.assertEqual(self.builds, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
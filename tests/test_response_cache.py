@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+# Copyright: Tanaka Aiko (https://github.com/aiko-tanaka)
+# License: GNU AGPL, version 3 or later; https://www.gnu.org/licenses/agpl-3.0.en.html
+
+"""
+ResponseCache against a temporary kanji_cache_path
+"""
+
+import unittest
+import tempfile
+import hashlib
+import time
+import sys
+import os
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from scraper.response_cache import response_cache
+from scraper.http_client import http_client
+from scraper.config import config
+
+
+class NoNetworkSession:
+    def get(self, url, headers=None, timeout=None):
+        raise AssertionError('went online for {}'.format(url))
+
+
+class ResponseCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.config = {key: config[key] for key in ('kanji_cache_path', 'offline_only',
+                                                    'response_cache_max_mb', 'response_cache_ttl_days')}
+        response_cache.close()
+        config['kanji_cache_path'] = self.folder.name
+        config['offline_only'] = False
+        config['response_cache_ttl_days'] = {'okjiten.jp': 30, 'default': 1}
+
+    def tearDown(self):
+        response_cache.close()
+        http_client._session = None
+        config.update(self.config)
+        self.folder.cleanup()
+
+    def set_fetched_at(self, url: str, fetched_at: float):
+        with response_cache._connect() as conn:
+            conn.execute('UPDATE responses SET fetched_at = ? WHERE url = ?', (fetched_at, url))
+
+    def test_ttl_per_host(self):
+        response_cache.store('https://okjiten.jp/kanji1.html', b'okjiten page', etag='"1"')
+        response_cache.store('https://example.com/page', b'other page')
+
+        saved = response_cache.lookup('https://okjiten.jp/kanji1.html')
+        self.assertEqual((saved['body'], saved['fresh'], saved['etag']), (b'okjiten page', True, '"1"'))
+
+        # two days old: still fresh for okjiten (30 days), stale for the default TTL (1 day)
+        two_days_ago = time.time() - 2 * 24 * 60 * 60
+        self.set_fetched_at('https://okjiten.jp/kanji1.html', two_days_ago)
+        self.set_fetched_at('https://example.com/page', two_days_ago)
+        self.assertTrue(response_cache.lookup('https://okjiten.jp/kanji1.html')['fresh'])
+        self.assertFalse(response_cache.lookup('https://example.com/page')['fresh'])
+
+        # a 304 makes it fresh again
+        response_cache.revalidated('https://example.com/page')
+        self.assertTrue(response_cache.lookup('https://example.com/page')['fresh'])
+
+        self.assertIsNone(response_cache.lookup('https://okjiten.jp/kanji2.html'))
+
+    def test_least_recently_used_page_is_evicted(self):
+        body_size = 400 * 1024
+        # room for two bodies, not three
+        config['response_cache_max_mb'] = 1
+
+        response_cache.store('https://okjiten.jp/a.html', b'a' * body_size)
+        response_cache.store('https://okjiten.jp/b.html', b'b' * body_size)
+        time.sleep(0.01)
+        # a is read after b was stored, b is now the least recently used
+        response_cache.lookup('https://okjiten.jp/a.html')
+        time.sleep(0.01)
+        response_cache.store('https://okjiten.jp/c.html', b'c' * body_size)
+
+        self.assertIsNone(response_cache.lookup('https://okjiten.jp/b.html'))
+        self.assertIsNotNone(response_cache.lookup('https://okjiten.jp/a.html'))
+        self.assertIsNotNone(response_cache.lookup('https://okjiten.jp/c.html'))
+        self.assertEqual(response_cache._total_size, 2 * body_size)
+        self.assertFalse(os.path.isfile(response_cache._body_path(hashlib.sha256(b'b' * body_size).hexdigest())))
+
+    def test_shared_body_is_counted_once(self):
+        body = b'<html>same page</html>'
+        response_cache.store('https://okjiten.jp/kanji1.html', body)
+        response_cache.store('https://okjiten.jp/kanji1.html?ref=index', body)
+        self.assertEqual(response_cache._total_size, len(body))
+
+        # one url moves on to a new body, the shared one is kept for the other url
+        response_cache.store('https://okjiten.jp/kanji1.html', b'<html>new page</html>')
+        self.assertEqual(response_cache.lookup('https://okjiten.jp/kanji1.html?ref=index')['body'], body)
+        self.assertEqual(response_cache._total_size, len(body) + len(b'<html>new page</html>'))
+
+        # counted the same way once the sqlite file is opened again
+        response_cache.close()
+        response_cache._connect()
+        self.assertEqual(response_cache._total_size, len(body) + len(b'<html>new page</html>'))
+
+    def test_offline_only(self):
+        response_cache.store('https://okjiten.jp/kanji1.html', b'okjiten page')
+        self.set_fetched_at('https://okjiten.jp/kanji1.html', 0)
+        config['offline_only'] = True
+        http_client._session = NoNetworkSession()
+
+        # stale pages are served as they are, a miss is None, nothing goes online
+        self.assertEqual(http_client.get('https://okjiten.jp/kanji1.html'), b'okjiten page')
+        self.assertIsNone(http_client.get('https://okjiten.jp/kanji2.html'))
+
+
+if __name__ == '__main__':
+    unittest.main()
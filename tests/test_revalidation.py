@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+# Copyright: Tanaka Aiko (https://github.com/aiko-tanaka)
+# License: GNU AGPL, version 3 or later; https://www.gnu.org/licenses/agpl-3.0.en.html
+
+"""
+Background revalidation of stale okjiten entries, nothing goes online
+"""
+
+import unittest
+import tempfile
+import sys
+import os
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from scraper import online_dictionaries
+from scraper.online_dictionaries import okjiten_store
+from scraper.response_cache import response_cache
+from scraper.http_client import http_client
+from scraper.config import config
+
+import requests
+
+
+class UnreachableSession:
+    """
+    Stands in for the requests session of http_client, okjiten answers 503 to everything
+    """
+    def __init__(self):
+        self.requests = 0
+
+    def get(self, url, headers=None, timeout=None):
+        self.requests += 1
+        response = requests.Response()
+        response.status_code = 503
+        return response
+
+
+class RevalidationTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.config = {key: config[key] for key in ('kanji_cache_path', 'offline_only', 'http_retries')}
+        okjiten_store.close()
+        response_cache.close()
+        config['kanji_cache_path'] = self.folder.name
+        config['offline_only'] = False
+
+        self.scrape = online_dictionaries._scrape_okjiten_kanji
+
+    def tearDown(self):
+        online_dictionaries._scrape_okjiten_kanji = self.scrape
+        online_dictionaries._okjiten_index = None
+        http_client._session = None
+        http_client._host_breakers.clear()
+        okjiten_store._pending.clear()
+        okjiten_store.close()
+        response_cache.close()
+        config.update(self.config)
+        self.folder.cleanup()
+
+    def revalidate(self, kanji: str):
+        online_dictionaries.revalidate_okjiten_kanji(kanji)
+        online_dictionaries._revalidation_executor.submit(lambda: None).result()
+
+    def committed(self) -> list:
+        return [key for key, in okjiten_store._connect().execute('SELECT key FROM okjiten ORDER BY key')]
+
+    def test_only_the_revalidated_kanji_is_committed(self):
+        def scrape(kanji, cache, revalidate=False):
+            okjiten_store.put(kanji, {'kanji': kanji})
+            return {'kanji': kanji}
+        online_dictionaries._scrape_okjiten_kanji = scrape
+
+        # a foreground entry of the run in progress, left for commit_caches()
+        okjiten_store.put('本', {'kanji': '本'})
+        self.revalidate('夢')
+
+        self.assertEqual(self.committed(), ['夢'])
+        self.assertIn('本', okjiten_store._pending)
+
+    def test_unreachable_okjiten_leaves_the_entry_stale(self):
+        page = 'https://okjiten.jp/kanji1.html'
+        stale = {'kanji': '夢', 'definition': 'dream', 'etymology_text': 'old'}
+        online_dictionaries._okjiten_index = {'夢': ['https://okjiten.jp/10-jyouyoukanjiitiran.html', 'kanji1.html']}
+        response_cache.store(page, b'<html>saved page</html>')
+        okjiten_store.put('夢', stale, updated_at=1.0)
+        okjiten_store.commit()
+
+        config['http_retries'] = 0
+        http_client._session = session = UnreachableSession()
+        self.revalidate('夢')
+
+        self.assertEqual(session.requests, 1)
+        self.assertNotIn('夢', okjiten_store._pending)
+        self.assertEqual(okjiten_store.get_entry('夢'), (stale, 1.0))
+
+    def test_failure_is_logged(self):
+        def scrape(kanji, cache, revalidate=False):
+            raise ValueError('unexpected page')
+        online_dictionaries._scrape_okjiten_kanji = scrape
+
+        with self.assertLogs(online_dictionaries.speed_logger, 'ERROR'):
+            self.revalidate('夢')
+        self.assertNotIn('夢', online_dictionaries._revalidating)
+
+
+if __name__ == '__main__':
+    unittest.main()